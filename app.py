@@ -1,12 +1,29 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify
+from flask import Flask, render_template, request, redirect, url_for, jsonify, Response, flash
 import sqlite3
 import os
 import subprocess
 import shutil
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
 import threading
 import time
+import queue
+import re
+import fcntl
+import signal
+import random
+import hashlib
+import json
+import socket
+import urllib.request
+from collections import deque
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'
@@ -17,7 +34,8 @@ logging.basicConfig(
 )
 app.logger.setLevel(logging.INFO)
 
-DATABASE_PATH = '/app/data/video_validation.db'
+DATABASE_PATH = os.environ.get('DATABASE_PATH', '/app/data/video_validation.db')
+# Libraries created on first start; after that they are managed on the Settings page
 MEDIA_PATHS = {
     'movie': '/media/movies',
     'tv': '/media/tv'
@@ -28,22 +46,599 @@ CHECKPOINTS = {
     'movie': [60, 600, 1800],
     'tv': [60, 300, 600]
 }
+CHECKPOINT_TIMEOUT = 15
+LIBRARY_NAME_PATTERN = re.compile(r'^[a-z0-9_-]+$')
+DURATION_PATTERN = re.compile(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)')
+ERROR_LEVEL_PATTERN = re.compile(r'\[(?:error|fatal)\] ')
+# Stop a checkpoint decode once it has logged this many errors (0 disables) and cap the stored text
+FFMPEG_ERROR_LIMIT = int(os.environ.get('FFMPEG_ERROR_LIMIT', 10))
+MAX_ERROR_CHARS = int(os.environ.get('MAX_ERROR_CHARS', 2000))
+# Extra decode windows sampled per validation on top of the fixed checkpoints. Each file keeps a
+# seed and a round counter so successive scans test different windows and cover the whole file
+SAMPLE_WINDOWS = int(os.environ.get('SAMPLE_WINDOWS', 0))
+SAMPLE_WINDOW_SECONDS = int(os.environ.get('SAMPLE_WINDOW_SECONDS', 2))
+SAMPLE_MODE = os.environ.get('SAMPLE_MODE', 'stratified').lower()
+# Incremental scans only revisit changed files, so with sampling on each one also revalidates
+# the 1/N of unchanged passed files checked longest ago; every window advances every N scans
+SAMPLE_ROTATION_SCANS = int(os.environ.get('SAMPLE_ROTATION_SCANS', 10))
+# Deep mode decodes every keyframe of the whole file instead of sampling windows
+DEEP_SCAN = os.environ.get('DEEP_SCAN', '').lower() in ('1', 'true', 'yes')
+DEEP_SCAN_TIMEOUT = int(os.environ.get('DEEP_SCAN_TIMEOUT', 1800))
+# Bytes hashed from the start, middle and end of a file to recognise it after a move or rename
+FINGERPRINT_CHUNK = 1024 * 1024
+
+SCAN_WORKERS = int(os.environ.get('SCAN_WORKERS', os.cpu_count() or 2))
+MOUNT_WORKERS = {
+    'movie': int(os.environ.get('MOVIE_SCAN_WORKERS', SCAN_WORKERS)),
+    'tv': int(os.environ.get('TV_SCAN_WORKERS', SCAN_WORKERS))
+}
+WRITE_BATCH_SIZE = int(os.environ.get('WRITE_BATCH_SIZE', 200))
+WRITE_BATCH_INTERVAL = float(os.environ.get('WRITE_BATCH_INTERVAL', 2.0))
+# Bound on host parameters per statement; older SQLite builds allow at most 999
+SQLITE_MAX_VARIABLES = 900
+
+# 'off', 'auto' (filesystem events plus a periodic walk) or 'poll' (periodic walk only)
+WATCH_MODE = os.environ.get('WATCH_MODE', 'off').lower()
+WATCH_POLL_INTERVAL = int(os.environ.get('WATCH_POLL_INTERVAL', 900))
+# In auto mode filesystem events catch changes, so the walk is only a safety net
+WATCH_FULL_WALK_INTERVAL = int(os.environ.get('WATCH_FULL_WALK_INTERVAL', 86400))
+WATCH_SETTLE_SECONDS = int(os.environ.get('WATCH_SETTLE_SECONDS', 120))
+
+REPAIR_WORKERS = int(os.environ.get('REPAIR_WORKERS', 2))
+REENCODE_WORKERS = int(os.environ.get('REENCODE_WORKERS', 1))
+BACKUP_MAX_GB = float(os.environ.get('BACKUP_MAX_GB', 0))
+BACKUP_RETENTION_DAYS = int(os.environ.get('BACKUP_RETENTION_DAYS', 0))
+FICLONE = 0x40049409
+RESULTS_PER_PAGE = 200
+RESULT_COLUMNS = 'id, filepath, status, errors, last_checked, repair_attempted, repair_success'
+# Fault classes recognised in the validation error text, most specific first, and the repair
+# strategies (by number) that can fix each one. Anything unrecognised gets the full cascade
+FAULT_PATTERNS = [
+    ('missing_index', re.compile(r'moov atom not found')),
+    ('truncated', re.compile(r'End of file|partial file|Truncating packet|premature end', re.IGNORECASE)),
+    ('timestamps', re.compile(r'non[- ]monoton|Timestamps are unset|invalid dts|out of order|pts has no value', re.IGNORECASE)),
+    ('container', re.compile(
+        r'EBML|exceeds containing master element|Packet corrupt|corrupt input packet|'
+        r'invalid packet size|Error opening input'
+    )),
+    ('bitstream', re.compile(
+        r'error while decoding|concealing|decode_slice|channel element|Invalid NAL|'
+        r'Error submitting packet to decoder|corrupt decoded frame|Input buffer exhausted'
+    ))
+]
+FAULT_STRATEGIES = {
+    # Without its index an MP4 cannot even be opened; only tools that use a reference file help
+    'missing_index': [],
+    # A remux rewrites the index and duration; re-encoding the same packets gains nothing
+    'truncated': [1],
+    'timestamps': [1, 3],
+    # discardcorrupt drops the packets the demuxer flags, which a plain rebuild would copy
+    'container': [2, 3],
+    # Stream copies pass damaged frames through unchanged; only decoding and re-encoding helps
+    'bitstream': [3],
+    'unknown': [1, 2, 3]
+}
+OUTPUT_FORMATS = {'.mp4': 'mp4', '.mkv': 'matroska', '.avi': 'avi', '.mov': 'mov', '.wmv': 'asf'}
+
+# Pause validation while the host is busy; 0 disables the check
+SCAN_MAX_LOAD = float(os.environ.get('SCAN_MAX_LOAD', 0))
+SCAN_IO_BUDGET_MBPS = float(os.environ.get('SCAN_IO_BUDGET_MBPS', 0))
+LOAD_CHECK_INTERVAL = 10
+
+STATS_RECONCILE_INTERVAL = int(os.environ.get('STATS_RECONCILE_INTERVAL', 6 * 3600))
+
+# Scan history older than HISTORY_DETAIL_DAYS is merged into one row per week. History and the
+# per-file failure timeline are deleted after their retention period (0 keeps them forever)
+HISTORY_DETAIL_DAYS = int(os.environ.get('HISTORY_DETAIL_DAYS', 30))
+HISTORY_RETENTION_DAYS = int(os.environ.get('HISTORY_RETENTION_DAYS', 730))
+TIMELINE_RETENTION_DAYS = int(os.environ.get('TIMELINE_RETENTION_DAYS', 365))
+HISTORY_PER_PAGE = 50
+
+# Prometheus text exposition at /metrics; when disabled every hook returns before taking a lock
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '').lower() in ('1', 'true', 'yes')
+METRIC_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
+METRIC_HELP = {
+    'validator_files_scanned_total': ('counter', 'Files validated, by library and result'),
+    'validator_checkpoints_total': ('counter', 'Checkpoint decodes, by library, checkpoint and result'),
+    'validator_validation_seconds': ('histogram', 'Wall time to validate one file'),
+    'validator_ffmpeg_seconds': ('histogram', 'Wall time of ffmpeg validation runs, by outcome'),
+    'validator_db_commit_seconds': ('histogram', 'Latency of scan result batch commits'),
+    'validator_db_rows_written_total': ('counter', 'Scan results written to the database'),
+    'validator_repair_seconds': ('histogram', 'Wall time of repair strategies, by strategy'),
+    'validator_repair_attempts_total': ('counter', 'Repair strategy runs, by strategy and outcome'),
+    'validator_repair_diagnoses_total': ('counter', 'Repairs started, by diagnosed fault'),
+    'validator_queue_depth': ('gauge', 'Files waiting, by queue'),
+    'validator_scan_active': ('gauge', 'Whether a scan job is running'),
+    'validator_scan_throttled': ('gauge', 'Whether validation is paused because the host is busy'),
+}
+
+# Distributed scanning: a coordinator queues candidate files in the work_queue table and
+# validates them together with worker nodes that lease batches over HTTP
+NODE_ROLE = os.environ.get('NODE_ROLE', 'standalone').lower()
+COORDINATOR_URL = os.environ.get('COORDINATOR_URL', 'http://localhost:5000')
+WORKER_TOKEN = os.environ.get('WORKER_TOKEN', '')
+LEASE_SECONDS = int(os.environ.get('LEASE_SECONDS', 900))
+LEASE_BATCH_SIZE = int(os.environ.get('LEASE_BATCH_SIZE', 4))
+WORK_MAX_ATTEMPTS = int(os.environ.get('WORK_MAX_ATTEMPTS', 3))
+WORK_POLL_INTERVAL = 5
+COORDINATOR_LOCAL_WORKERS = int(os.environ.get('COORDINATOR_LOCAL_WORKERS', SCAN_WORKERS))
+# Worker nodes that mount the libraries elsewhere: "/media=/mnt/nas/media,..."
+PATH_MAP = [
+    tuple(entry.split('=', 1)) for entry in os.environ.get('PATH_MAP', '').split(',') if '=' in entry
+]
+
+# Progress events pushed to /events; reconnecting clients replay what they missed from the buffer
+EVENT_BUFFER_SIZE = 256
+EVENT_KEEPALIVE = 15
+
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+OCCURRENCES = ['first', 'second', 'third', 'fourth']
 
 repair_progress = {
     'active': False,
     'current_file': '',
     'completed': 0,
+    'succeeded': 0,
+    'failed': 0,
     'total': 0,
+    'queued_remux': 0,
+    'queued_reencode': 0,
+    'workers': {},
     'status': 'idle'
 }
+repair_lock = threading.Lock()
+
+scan_progress = {
+    'active': False,
+    'job_id': None,
+    'media_type': None,
+    'full_rescan': False,
+    'current_file': '',
+    'completed': 0,
+    'total': 0,
+    'status': 'idle',
+    'throttled': False,
+    'history_id': None,
+    'write_errors': 0,
+    'walk_errors': []
+}
+scan_lock = threading.Lock()
+# Queued scan jobs, refreshed when a job is queued, started, finished or cancelled
+scan_queue = {'queued': 0}
+scan_cancel_event = threading.Event()
+# Global cap on concurrent ffmpeg runs, shared by scans and the media watcher
+scan_slots = threading.BoundedSemaphore(SCAN_WORKERS)
+watch_pending = {}
+watch_lock = threading.Lock()
+load_state = {'checked_at': 0, 'busy': False, 'io_sample': None}
+load_lock = threading.Lock()
+_thread_db = threading.local()
+scan_job_wakeup = threading.Event()
+metric_values = {}
+metrics_lock = threading.Lock()
+event_buffer = deque(maxlen=EVENT_BUFFER_SIZE)
+event_condition = threading.Condition()
+event_state = {'last_id': 0}
+libraries = {}
+
+def _metric_inc(name, amount=1, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with metrics_lock:
+        metric_values[key] = metric_values.get(key, 0) + amount
+
+def _metric_set(name, value, **labels):
+    if not METRICS_ENABLED:
+        return
+    with metrics_lock:
+        metric_values[(name, tuple(sorted(labels.items())))] = value
+
+def _metric_observe(name, seconds, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with metrics_lock:
+        # Per-bucket counts followed by sum and count; made cumulative when rendered
+        histogram = metric_values.get(key)
+        if histogram is None:
+            histogram = metric_values[key] = [0] * (len(METRIC_BUCKETS) + 2)
+        for index, bound in enumerate(METRIC_BUCKETS):
+            if seconds <= bound:
+                histogram[index] += 1
+                break
+        histogram[-2] += seconds
+        histogram[-1] += 1
+
+def _format_labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in pairs
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+def render_metrics():
+    with metrics_lock:
+        snapshot = {key: list(value) if isinstance(value, list) else value for key, value in metric_values.items()}
+    lines = []
+    for name, (metric_type, help_text) in METRIC_HELP.items():
+        series = sorted((labels, value) for (metric, labels), value in snapshot.items() if metric == name)
+        if not series:
+            continue
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        for labels, value in series:
+            if metric_type != 'histogram':
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+                continue
+            cumulative = 0
+            for bound, count in zip(METRIC_BUCKETS, value):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels, le=bound)} {cumulative}')
+            lines.append(f'{name}_bucket{_format_labels(labels, le="+Inf")} {value[-1]}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {value[-2]}')
+            lines.append(f'{name}_count{_format_labels(labels)} {value[-1]}')
+    return '\n'.join(lines) + '\n'
+
+def publish_event(kind, data):
+    payload = json.dumps(data, default=str)
+    with event_condition:
+        event_state['last_id'] += 1
+        event_buffer.append((event_state['last_id'], kind, payload))
+        event_condition.notify_all()
+
+def _events_after(last_id, timeout):
+    # Returns the buffered events newer than last_id, waiting up to timeout for one to arrive,
+    # and whether the buffer still reaches back to last_id
+    with event_condition:
+        if last_id > event_state['last_id'] or (event_buffer and event_buffer[0][0] > last_id + 1):
+            return [], False
+        if last_id == event_state['last_id']:
+            event_condition.wait(timeout)
+        return [event for event in event_buffer if event[0] > last_id], True
 
 def get_db_connection():
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = sqlite3.connect(DATABASE_PATH, timeout=30)
     conn.row_factory = sqlite3.Row
+    # WAL keeps readers from blocking behind scan writes; NORMAL only fsyncs at checkpoints
+    conn.execute('PRAGMA synchronous = NORMAL')
+    # INSERT OR REPLACE must fire the delete trigger that keeps library_stats in step
+    conn.execute('PRAGMA recursive_triggers = ON')
+    return conn
+
+def get_thread_db_connection():
+    conn = getattr(_thread_db, 'conn', None)
+    if conn is None:
+        conn = get_db_connection()
+        _thread_db.conn = conn
     return conn
 
+LIBRARY_STATS_REBUILD = '''
+    INSERT OR REPLACE INTO library_stats (media_type, total, passed, failed)
+    SELECT
+        media_type,
+        COUNT(*),
+        SUM(CASE WHEN status = 'passed' THEN 1 ELSE 0 END),
+        SUM(CASE WHEN status = 'failed' THEN 1 ELSE 0 END)
+    FROM validation_results
+    GROUP BY media_type
+'''
+CHECKPOINT_FAILURES_REBUILD = '''
+    INSERT OR REPLACE INTO checkpoint_failures (media_type, checkpoint, failed)
+    SELECT media_type, checkpoint, COUNT(*)
+    FROM checkpoint_results
+    WHERE result = 0
+    GROUP BY media_type, checkpoint
+'''
+# Checkpoint columns of the original schema, carried over into checkpoint_results by migration 7
+LEGACY_CHECK_COLUMNS = {60: 'check_1m', 300: 'check_5m', 600: 'check_10m', 1800: 'check_30m'}
+
+def _parse_checkpoints(text):
+    return sorted({int(value) for value in text.replace(' ', '').split(',') if value})
+
+def _seed_libraries(conn):
+    labels = {'movie': 'Movies', 'tv': 'TV Shows'}
+    conn.executemany('''
+        INSERT INTO libraries (name, label, paths, extensions, checkpoints)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [
+        (name, labels.get(name, name.capitalize()), path, ','.join(VIDEO_EXTENSIONS),
+         ','.join(str(seconds) for seconds in CHECKPOINTS[name]))
+        for name, path in MEDIA_PATHS.items()
+    ])
+
+def _migrate_checkpoint_columns(conn):
+    # Only the checkpoints a library actually ran are carried over; TV rows never ran check_30m
+    # and only hold its default
+    for library in conn.execute('SELECT name, checkpoints FROM libraries').fetchall():
+        for seconds in _parse_checkpoints(library['checkpoints']):
+            column = LEGACY_CHECK_COLUMNS.get(seconds)
+            if column is None:
+                continue
+            conn.execute(f'''
+                INSERT OR IGNORE INTO checkpoint_results (result_id, media_type, checkpoint, result)
+                SELECT id, media_type, ?, {column} FROM validation_results WHERE media_type = ?
+            ''', (seconds, library['name']))
+
+SCHEMA_MIGRATIONS = [
+    # 1: stat snapshot fields used for change detection
+    [
+        'ALTER TABLE validation_results ADD COLUMN file_mtime_ns INTEGER',
+        'ALTER TABLE validation_results ADD COLUMN file_inode INTEGER'
+    ],
+    # 2: last time the scheduler fired, so missed runs are caught up after a restart
+    [
+        'ALTER TABLE app_settings ADD COLUMN last_scheduled_run TIMESTAMP'
+    ],
+    # 3: indexes backing keyset pagination of /results and the failure counts
+    [
+        '''CREATE INDEX IF NOT EXISTS idx_results_media_checked
+           ON validation_results (media_type, last_checked DESC, id DESC)''',
+        '''CREATE INDEX IF NOT EXISTS idx_results_media_status_checked
+           ON validation_results (media_type, status, last_checked DESC, id DESC)''',
+        'CREATE INDEX IF NOT EXISTS idx_results_status ON validation_results (status)'
+    ],
+    # 4: per-library counters for the dashboard, kept current by triggers. The triggers avoid
+    # INSERT OR IGNORE because an outer INSERT OR REPLACE would override it and reset the row
+    [
+        '''CREATE TABLE IF NOT EXISTS library_stats (
+               media_type TEXT PRIMARY KEY,
+               total INTEGER NOT NULL DEFAULT 0,
+               passed INTEGER NOT NULL DEFAULT 0,
+               failed INTEGER NOT NULL DEFAULT 0,
+               failed_1m INTEGER NOT NULL DEFAULT 0,
+               failed_5m INTEGER NOT NULL DEFAULT 0,
+               failed_10m INTEGER NOT NULL DEFAULT 0,
+               failed_30m INTEGER NOT NULL DEFAULT 0
+           )''',
+        '''CREATE TRIGGER IF NOT EXISTS library_stats_insert AFTER INSERT ON validation_results
+           BEGIN
+               INSERT INTO library_stats (media_type)
+               SELECT NEW.media_type WHERE NOT EXISTS (
+                   SELECT 1 FROM library_stats WHERE media_type = NEW.media_type
+               );
+               UPDATE library_stats SET
+                   total = total + 1,
+                   passed = passed + (NEW.status IS 'passed'),
+                   failed = failed + (NEW.status IS 'failed'),
+                   failed_1m = failed_1m + (NEW.check_1m IS 0),
+                   failed_5m = failed_5m + (NEW.check_5m IS 0),
+                   failed_10m = failed_10m + (NEW.check_10m IS 0),
+                   failed_30m = failed_30m + (NEW.check_30m IS 0)
+               WHERE media_type = NEW.media_type;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS library_stats_delete AFTER DELETE ON validation_results
+           BEGIN
+               UPDATE library_stats SET
+                   total = total - 1,
+                   passed = passed - (OLD.status IS 'passed'),
+                   failed = failed - (OLD.status IS 'failed'),
+                   failed_1m = failed_1m - (OLD.check_1m IS 0),
+                   failed_5m = failed_5m - (OLD.check_5m IS 0),
+                   failed_10m = failed_10m - (OLD.check_10m IS 0),
+                   failed_30m = failed_30m - (OLD.check_30m IS 0)
+               WHERE media_type = OLD.media_type;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS library_stats_update
+           AFTER UPDATE OF media_type, status, check_1m, check_5m, check_10m, check_30m ON validation_results
+           BEGIN
+               UPDATE library_stats SET
+                   total = total - 1,
+                   passed = passed - (OLD.status IS 'passed'),
+                   failed = failed - (OLD.status IS 'failed'),
+                   failed_1m = failed_1m - (OLD.check_1m IS 0),
+                   failed_5m = failed_5m - (OLD.check_5m IS 0),
+                   failed_10m = failed_10m - (OLD.check_10m IS 0),
+                   failed_30m = failed_30m - (OLD.check_30m IS 0)
+               WHERE media_type = OLD.media_type;
+               INSERT INTO library_stats (media_type)
+               SELECT NEW.media_type WHERE NOT EXISTS (
+                   SELECT 1 FROM library_stats WHERE media_type = NEW.media_type
+               );
+               UPDATE library_stats SET
+                   total = total + 1,
+                   passed = passed + (NEW.status IS 'passed'),
+                   failed = failed + (NEW.status IS 'failed'),
+                   failed_1m = failed_1m + (NEW.check_1m IS 0),
+                   failed_5m = failed_5m + (NEW.check_5m IS 0),
+                   failed_10m = failed_10m + (NEW.check_10m IS 0),
+                   failed_30m = failed_30m + (NEW.check_30m IS 0)
+               WHERE media_type = NEW.media_type;
+           END''',
+        LIBRARY_STATS_REBUILD
+    ],
+    # 5: per-file sampling state so rotating windows continue where the last scan stopped
+    [
+        'ALTER TABLE validation_results ADD COLUMN sample_seed INTEGER',
+        'ALTER TABLE validation_results ADD COLUMN sample_round INTEGER DEFAULT 0'
+    ],
+    # 6: content fingerprint used to carry results over when a file is moved or renamed
+    [
+        'ALTER TABLE validation_results ADD COLUMN content_hash TEXT',
+        'CREATE INDEX IF NOT EXISTS idx_results_size ON validation_results (file_size)'
+    ],
+    # 7: libraries defined in settings, and checkpoint results in a child table instead of a
+    # fixed check_* column per checkpoint
+    [
+        '''CREATE TABLE IF NOT EXISTS libraries (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               name TEXT UNIQUE NOT NULL,
+               label TEXT NOT NULL,
+               paths TEXT NOT NULL,
+               extensions TEXT NOT NULL,
+               checkpoints TEXT NOT NULL,
+               workers INTEGER,
+               checkpoint_timeout INTEGER,
+               enabled BOOLEAN NOT NULL DEFAULT 1
+           )''',
+        _seed_libraries,
+        '''CREATE TABLE IF NOT EXISTS checkpoint_results (
+               result_id INTEGER NOT NULL,
+               media_type TEXT NOT NULL,
+               checkpoint INTEGER NOT NULL,
+               result INTEGER NOT NULL,
+               PRIMARY KEY (result_id, checkpoint)
+           ) WITHOUT ROWID''',
+        '''CREATE INDEX IF NOT EXISTS idx_checkpoint_results_failures
+           ON checkpoint_results (result, media_type, checkpoint)''',
+        _migrate_checkpoint_columns,
+        # INSERT OR REPLACE deletes the old row, so this also clears the children of a rewritten result
+        '''CREATE TRIGGER IF NOT EXISTS checkpoint_results_delete AFTER DELETE ON validation_results
+           BEGIN
+               DELETE FROM checkpoint_results WHERE result_id = OLD.id;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS checkpoint_results_media_type
+           AFTER UPDATE OF media_type ON validation_results
+           BEGIN
+               UPDATE checkpoint_results SET media_type = NEW.media_type WHERE result_id = NEW.id;
+           END''',
+        'DROP TRIGGER IF EXISTS library_stats_insert',
+        'DROP TRIGGER IF EXISTS library_stats_delete',
+        'DROP TRIGGER IF EXISTS library_stats_update',
+        'DROP TABLE IF EXISTS library_stats',
+        '''CREATE TABLE library_stats (
+               media_type TEXT PRIMARY KEY,
+               total INTEGER NOT NULL DEFAULT 0,
+               passed INTEGER NOT NULL DEFAULT 0,
+               failed INTEGER NOT NULL DEFAULT 0
+           )''',
+        '''CREATE TRIGGER library_stats_insert AFTER INSERT ON validation_results
+           BEGIN
+               INSERT INTO library_stats (media_type)
+               SELECT NEW.media_type WHERE NOT EXISTS (
+                   SELECT 1 FROM library_stats WHERE media_type = NEW.media_type
+               );
+               UPDATE library_stats SET
+                   total = total + 1,
+                   passed = passed + (NEW.status IS 'passed'),
+                   failed = failed + (NEW.status IS 'failed')
+               WHERE media_type = NEW.media_type;
+           END''',
+        '''CREATE TRIGGER library_stats_delete AFTER DELETE ON validation_results
+           BEGIN
+               UPDATE library_stats SET
+                   total = total - 1,
+                   passed = passed - (OLD.status IS 'passed'),
+                   failed = failed - (OLD.status IS 'failed')
+               WHERE media_type = OLD.media_type;
+           END''',
+        '''CREATE TRIGGER library_stats_update AFTER UPDATE OF media_type, status ON validation_results
+           BEGIN
+               UPDATE library_stats SET
+                   total = total - 1,
+                   passed = passed - (OLD.status IS 'passed'),
+                   failed = failed - (OLD.status IS 'failed')
+               WHERE media_type = OLD.media_type;
+               INSERT INTO library_stats (media_type)
+               SELECT NEW.media_type WHERE NOT EXISTS (
+                   SELECT 1 FROM library_stats WHERE media_type = NEW.media_type
+               );
+               UPDATE library_stats SET
+                   total = total + 1,
+                   passed = passed + (NEW.status IS 'passed'),
+                   failed = failed + (NEW.status IS 'failed')
+               WHERE media_type = NEW.media_type;
+           END''',
+        LIBRARY_STATS_REBUILD,
+        'ALTER TABLE validation_results DROP COLUMN check_1m',
+        'ALTER TABLE validation_results DROP COLUMN check_5m',
+        'ALTER TABLE validation_results DROP COLUMN check_10m',
+        'ALTER TABLE validation_results DROP COLUMN check_30m'
+    ],
+    # 8: per-scan statistics kept current while the scan runs, and a per-file timeline of failures
+    # and recoveries. scans_merged counts the scans folded into a downsampled history row
+    [
+        'ALTER TABLE scan_history ADD COLUMN job_id INTEGER',
+        "ALTER TABLE scan_history ADD COLUMN status TEXT NOT NULL DEFAULT 'completed'",
+        'ALTER TABLE scan_history ADD COLUMN finished_at TIMESTAMP',
+        'ALTER TABLE scan_history ADD COLUMN files_passed INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE scan_history ADD COLUMN files_failed INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE scan_history ADD COLUMN new_failures INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE scan_history ADD COLUMN fixed_files INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE scan_history ADD COLUMN repaired_files INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE scan_history ADD COLUMN deleted_files INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE scan_history ADD COLUMN scans_merged INTEGER NOT NULL DEFAULT 1',
+        'CREATE INDEX IF NOT EXISTS idx_scan_history_time ON scan_history (scan_time DESC, id DESC)',
+        'CREATE INDEX IF NOT EXISTS idx_scan_history_job ON scan_history (job_id)',
+        '''CREATE TABLE IF NOT EXISTS failure_timeline (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               filepath TEXT NOT NULL,
+               media_type TEXT NOT NULL,
+               event_time TIMESTAMP NOT NULL,
+               event TEXT NOT NULL,
+               scan_id INTEGER,
+               diagnosis TEXT
+           )''',
+        'CREATE INDEX IF NOT EXISTS idx_failure_timeline_path ON failure_timeline (filepath, event_time)',
+        'CREATE INDEX IF NOT EXISTS idx_failure_timeline_time ON failure_timeline (event_time)'
+    ],
+    # 9: failed-checkpoint counters per library for the dashboard, kept current by triggers on
+    # checkpoint_results like library_stats is on validation_results
+    [
+        '''CREATE TABLE IF NOT EXISTS checkpoint_failures (
+               media_type TEXT NOT NULL,
+               checkpoint INTEGER NOT NULL,
+               failed INTEGER NOT NULL DEFAULT 0,
+               PRIMARY KEY (media_type, checkpoint)
+           ) WITHOUT ROWID''',
+        '''CREATE TRIGGER IF NOT EXISTS checkpoint_failures_insert AFTER INSERT ON checkpoint_results
+           WHEN NEW.result = 0
+           BEGIN
+               INSERT INTO checkpoint_failures (media_type, checkpoint)
+               SELECT NEW.media_type, NEW.checkpoint WHERE NOT EXISTS (
+                   SELECT 1 FROM checkpoint_failures
+                   WHERE media_type = NEW.media_type AND checkpoint = NEW.checkpoint
+               );
+               UPDATE checkpoint_failures SET failed = failed + 1
+               WHERE media_type = NEW.media_type AND checkpoint = NEW.checkpoint;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS checkpoint_failures_delete AFTER DELETE ON checkpoint_results
+           WHEN OLD.result = 0
+           BEGIN
+               UPDATE checkpoint_failures SET failed = failed - 1
+               WHERE media_type = OLD.media_type AND checkpoint = OLD.checkpoint;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS checkpoint_failures_update
+           AFTER UPDATE OF media_type, checkpoint, result ON checkpoint_results
+           BEGIN
+               UPDATE checkpoint_failures SET failed = failed - 1
+               WHERE OLD.result = 0 AND media_type = OLD.media_type AND checkpoint = OLD.checkpoint;
+               INSERT INTO checkpoint_failures (media_type, checkpoint)
+               SELECT NEW.media_type, NEW.checkpoint WHERE NEW.result = 0 AND NOT EXISTS (
+                   SELECT 1 FROM checkpoint_failures
+                   WHERE media_type = NEW.media_type AND checkpoint = NEW.checkpoint
+               );
+               UPDATE checkpoint_failures SET failed = failed + 1
+               WHERE NEW.result = 0 AND media_type = NEW.media_type AND checkpoint = NEW.checkpoint;
+           END''',
+        CHECKPOINT_FAILURES_REBUILD
+    ],
+    # 10: covering index for repeat-failure lookups, so a time window reads only its failures
+    [
+        '''CREATE INDEX IF NOT EXISTS idx_failure_timeline_event
+           ON failure_timeline (event, event_time, filepath, media_type)'''
+    ]
+]
+
+def _migrate_db(conn):
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for number, statements in enumerate(SCHEMA_MIGRATIONS[version:], start=version + 1):
+        for statement in statements:
+            # Data migrations that need Python are given as functions of the connection
+            if callable(statement):
+                statement(conn)
+            else:
+                conn.execute(statement)
+        conn.execute(f'PRAGMA user_version = {number}')
+        conn.commit()
+        app.logger.info(f"Applied database migration {number}")
+
 def init_db():
     conn = get_db_connection()
+    conn.execute('PRAGMA journal_mode = WAL')
     # Validation results table
     conn.execute('''
         CREATE TABLE IF NOT EXISTS validation_results (
@@ -84,6 +679,52 @@ def init_db():
             total_files_scanned INTEGER NOT NULL
         )
     ''')
+    # Backups kept after successful repairs, used for retention
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS repair_backups (
+            backup_path TEXT PRIMARY KEY,
+            filepath TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created_at TIMESTAMP NOT NULL
+        )
+    ''')
+    # Background scan jobs
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS scan_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            media_type TEXT,
+            full_rescan BOOLEAN NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'queued',
+            created_at TIMESTAMP NOT NULL,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            total_files INTEGER DEFAULT 0,
+            completed_files INTEGER DEFAULT 0,
+            current_file TEXT,
+            error TEXT
+        )
+    ''')
+    # Files of a distributed scan waiting for, or leased to, a validation node
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS work_queue (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id INTEGER,
+            media_type TEXT NOT NULL,
+            filepath TEXT NOT NULL,
+            file_inode INTEGER,
+            file_mtime_ns INTEGER,
+            file_size INTEGER,
+            sample_seed INTEGER,
+            sample_round INTEGER,
+            status TEXT NOT NULL DEFAULT 'queued',
+            lease_owner TEXT,
+            lease_expires TIMESTAMP,
+            attempts INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_work_queue_status ON work_queue (status, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_work_queue_job ON work_queue (job_id, status)')
+    _migrate_db(conn)
     # Initialize settings if empty
     if conn.execute('SELECT COUNT(*) FROM app_settings').fetchone()[0] == 0:
         conn.execute('''
@@ -95,427 +736,2148 @@ def init_db():
 
 init_db()
 
-def validate_video(filepath, media_type):
-    checkpoints = CHECKPOINTS[media_type]
+def _library_from_row(row):
+    # Empty workers and timeout follow the global defaults, so changing those still applies
+    return {
+        'name': row['name'],
+        'label': row['label'],
+        'paths': [path.strip() for path in row['paths'].splitlines() if path.strip()],
+        'extensions': [ext for ext in row['extensions'].split(',') if ext],
+        'checkpoints': _parse_checkpoints(row['checkpoints']),
+        'workers': row['workers'] or MOUNT_WORKERS.get(row['name'], SCAN_WORKERS),
+        'checkpoint_timeout': row['checkpoint_timeout'] or CHECKPOINT_TIMEOUT,
+        'enabled': bool(row['enabled'])
+    }
+
+def load_libraries():
+    global libraries
+    conn = get_db_connection()
+    try:
+        rows = conn.execute('SELECT * FROM libraries ORDER BY id').fetchall()
+    finally:
+        conn.close()
+    libraries = {row['name']: _library_from_row(row) for row in rows}
+
+load_libraries()
+
+def _library_config(name):
+    # A library deleted while its files are still queued validates them with the defaults
+    return libraries.get(name) or {
+        'name': name, 'label': name, 'paths': [], 'extensions': VIDEO_EXTENSIONS,
+        'checkpoints': CHECKPOINTS.get(name, [60]), 'workers': SCAN_WORKERS,
+        'checkpoint_timeout': CHECKPOINT_TIMEOUT, 'enabled': False
+    }
+
+def _enabled_libraries():
+    return [name for name, library in libraries.items() if library['enabled']]
+
+def _checkpoint_label(seconds):
+    return f'{seconds // 60}m' if seconds % 60 == 0 else f'{seconds}s'
+
+def _parse_ffmpeg_duration(output):
+    match = DURATION_PATTERN.search(output)
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+def _kill_process_group(proc, reason=None):
+    if reason is not None:
+        reason.set()
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+def _run_ffmpeg(cmd, timeout, error_limit=None):
+    # Streams stderr line by line so an error flood can be cut short; ffmpeg gets its own
+    # process group so a timeout kills everything it spawned
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        start_new_session=True
+    )
+    timed_out = threading.Event()
+    timer = threading.Timer(timeout, _kill_process_group, args=(proc, timed_out))
+    timer.start()
+    error_lines = []
+    error_chars = 0
+    error_count = 0
+    duration = None
+    aborted = False
+    try:
+        for raw_line in proc.stderr:
+            line = raw_line.decode(errors='replace').rstrip()
+            if duration is None:
+                duration = _parse_ffmpeg_duration(line)
+            if not ERROR_LEVEL_PATTERN.search(line):
+                continue
+            error_count += 1
+            if error_chars < MAX_ERROR_CHARS:
+                line = ERROR_LEVEL_PATTERN.sub('', line)
+                error_lines.append(line)
+                error_chars += len(line) + 1
+            if error_limit and error_count >= error_limit:
+                aborted = True
+                _kill_process_group(proc)
+                break
+        returncode = proc.wait()
+    finally:
+        timer.cancel()
+        proc.stderr.close()
+    if error_count > len(error_lines):
+        error_lines.append(f'... {error_count - len(error_lines)} more error lines')
+    outcome = 'timeout' if timed_out.is_set() else 'aborted' if aborted else None
+    _metric_observe(
+        'validator_ffmpeg_seconds', time.perf_counter() - started,
+        outcome=outcome or ('ok' if returncode == 0 else 'error')
+    )
+    return returncode, error_lines, duration, outcome
+
+def _run_checkpoint(filepath, seconds, timeout=CHECKPOINT_TIMEOUT, length=1, checkpoint_name=None):
+    ffmpeg_cmd = [
+        'ffmpeg',
+        '-loglevel', 'level+error',
+        '-ss', str(seconds), '-t', str(length),
+        '-i', filepath, '-f', 'null', '-'
+    ]
+    checkpoint_name = checkpoint_name or f'check_{_checkpoint_label(seconds)}'
+    returncode, error_lines, _, outcome = _run_ffmpeg(ffmpeg_cmd, timeout, FFMPEG_ERROR_LIMIT)
+    if outcome == 'timeout':
+        return f'[{filepath}] {checkpoint_name}: Timeout'
+    if outcome == 'aborted':
+        error_lines.append(f'Aborted after {FFMPEG_ERROR_LIMIT} errors')
+    elif returncode == 0:
+        return None
+    output = '\n'.join(error_lines)
+    return f'[{filepath}] {checkpoint_name}: {output}'
+
+def _windows_command(filepath, windows, length, loglevel='level+error'):
+    # One ffmpeg run opens the file once per window; with level+info it also reports the
+    # container duration in its input header, replacing the separate ffprobe call
+    ffmpeg_cmd = ['ffmpeg', '-hide_banner', '-nostats', '-loglevel', loglevel]
+    for seconds in windows:
+        ffmpeg_cmd += ['-ss', str(seconds), '-t', str(length), '-i', filepath]
+    for index in range(len(windows)):
+        ffmpeg_cmd += ['-map', f'{index}:v:0?', '-map', f'{index}:a:0?']
+    ffmpeg_cmd += ['-f', 'null', '-']
+    return ffmpeg_cmd
+
+def _sample_windows(duration, seed, round_no, count=SAMPLE_WINDOWS, mode=SAMPLE_MODE):
+    # The file is cut into SAMPLE_WINDOW_SECONDS slots visited in a seeded order, so round N
+    # never repeats a slot of an earlier round until the whole file has been covered
+    slots = int(duration // SAMPLE_WINDOW_SECONDS)
+    if slots <= 0 or count <= 0:
+        return []
+    count = min(count, slots)
+    rng = random.Random(seed)
+    if mode == 'random':
+        order = list(range(slots))
+        rng.shuffle(order)
+        start = round_no * count % slots
+        picked = (order + order)[start:start + count]
+    else:
+        # Stratified: one window from each of count equal slices of the file
+        picked = []
+        for stratum in range(count):
+            order = list(range(slots * stratum // count, slots * (stratum + 1) // count))
+            rng.shuffle(order)
+            picked.append(order[round_no % len(order)])
+    return sorted(slot * SAMPLE_WINDOW_SECONDS for slot in picked)
+
+def _sample_check(filepath, windows, timeout=CHECKPOINT_TIMEOUT):
+    ffmpeg_cmd = _windows_command(filepath, windows, SAMPLE_WINDOW_SECONDS)
+    returncode, _, _, outcome = _run_ffmpeg(ffmpeg_cmd, timeout * len(windows), FFMPEG_ERROR_LIMIT)
+    if returncode == 0 and outcome is None:
+        return []
+    errors = []
+    for seconds in windows:
+        error_msg = _run_checkpoint(filepath, seconds, timeout, SAMPLE_WINDOW_SECONDS, f'sample_{seconds}s')
+        if error_msg:
+            errors.append(error_msg)
+    return errors
+
+def _deep_check(filepath):
+    # Keyframe-only decode of the whole file: every packet is demuxed but only keyframes are
+    # decoded, which finds container damage anywhere at a fraction of a full decode's cost
+    ffmpeg_cmd = [
+        'ffmpeg', '-hide_banner', '-nostats', '-loglevel', 'level+error',
+        '-skip_frame', 'nokey', '-i', filepath,
+        '-map', '0:v:0?', '-map', '0:a:0?', '-f', 'null', '-'
+    ]
+    returncode, error_lines, _, outcome = _run_ffmpeg(ffmpeg_cmd, DEEP_SCAN_TIMEOUT, FFMPEG_ERROR_LIMIT)
+    if outcome == 'timeout':
+        return f'[{filepath}] full_decode: Timeout'
+    if outcome == 'aborted':
+        error_lines.append(f'Aborted after {FFMPEG_ERROR_LIMIT} errors')
+    elif returncode == 0:
+        return None
+    output = '\n'.join(error_lines)
+    return f'[{filepath}] full_decode: {output}'
+
+def validate_video(filepath, library, sample_state=None):
+    checkpoints = library['checkpoints']
+    timeout = library['checkpoint_timeout']
     errors = []
-    check_results = {f'check_{t//60}m': 0 for t in [60, 300, 600, 1800]}
+    # A file that cannot be opened fails every checkpoint
+    check_results = {'checkpoints': dict.fromkeys(checkpoints, 0)}
+    seed, round_no = sample_state or (None, 0)
+    if seed is None:
+        seed = random.getrandbits(31)
+    check_results['sample_seed'] = seed
+    check_results['sample_round'] = round_no or 0
+    ffmpeg_cmd = _windows_command(filepath, checkpoints, 1, 'level+info')
+    started = time.perf_counter()
     try:
-        duration_cmd = [
-            'ffprobe', '-v', 'error', '-show_entries', 'format=duration',
-            '-of', 'default=noprint_wrappers=1:nokey=1', filepath
-        ]
-        duration = float(subprocess.check_output(duration_cmd).decode().strip())
+        returncode, error_lines, duration, outcome = _run_ffmpeg(
+            ffmpeg_cmd, timeout * len(checkpoints), FFMPEG_ERROR_LIMIT
+        )
+        passed = returncode == 0 and outcome is None
     except Exception as e:
+        # _run_ffmpeg only records its run time when ffmpeg could be started and read
+        _metric_observe('validator_ffmpeg_seconds', time.perf_counter() - started, outcome='error')
+        _count_checkpoints(library, check_results)
         return 'failed', f'[{filepath}] Could not get duration: {e}', 0, check_results
+    if duration is None:
+        # Truncated or unreadable files still show up as failed checkpoints
+        _count_checkpoints(library, check_results)
+        details = 'Timeout' if outcome == 'timeout' else '\n'.join(error_lines)
+        return 'failed', f'[{filepath}] Could not get duration: {details}', 0, check_results
     for seconds in checkpoints:
-        checkpoint_name = f'check_{seconds//60}m'
         if duration > seconds:
-            ffmpeg_cmd = [
-                'ffmpeg',
-                '-v', 'error',
-                '-ss', str(seconds), '-t', '1',
-                '-i', filepath, '-f', 'null', '-'
-            ]
-            try:
-                subprocess.check_output(ffmpeg_cmd, stderr=subprocess.STDOUT, timeout=15)
-                check_results[checkpoint_name] = 1
-            except subprocess.CalledProcessError as e:
-                error_msg = f'[{filepath}] {checkpoint_name}: {e.output.decode().strip()}'
+            # The combined run only tells us that something failed; rerun the individual
+            # windows so every checkpoint keeps its own pass/fail result and error text.
+            # A combined run that timed out already used the whole budget, so nothing is rerun
+            if passed:
+                error_msg = None
+            elif outcome == 'timeout':
+                error_msg = f'[{filepath}] check_{_checkpoint_label(seconds)}: Timeout'
+            else:
+                error_msg = _run_checkpoint(filepath, seconds, timeout)
+            if error_msg:
                 errors.append(error_msg)
-                check_results[checkpoint_name] = 0
-            except subprocess.TimeoutExpired:
-                error_msg = f'[{filepath}] {checkpoint_name}: Timeout'
-                errors.append(error_msg)
-                check_results[checkpoint_name] = 0
+                check_results['checkpoints'][seconds] = 0
+            else:
+                check_results['checkpoints'][seconds] = 1
         else:
-            check_results[checkpoint_name] = -1
+            check_results['checkpoints'][seconds] = -1
+    if DEEP_SCAN:
+        error_msg = _deep_check(filepath)
+        if error_msg:
+            errors.append(error_msg)
+    elif SAMPLE_WINDOWS > 0:
+        windows = _sample_windows(duration, seed, check_results['sample_round'])
+        if windows:
+            errors += _sample_check(filepath, windows, timeout)
+            check_results['sample_round'] += 1
     status = "passed" if not errors else "failed"
+    _count_checkpoints(library, check_results)
     return status, '\n'.join(errors), duration, check_results
 
-def should_validate_file(filepath, db_row):
+def _count_checkpoints(library, check_results):
+    if not METRICS_ENABLED:
+        return
+    for seconds, result in check_results['checkpoints'].items():
+        _metric_inc(
+            'validator_checkpoints_total', media_type=library['name'],
+            checkpoint=f'check_{_checkpoint_label(seconds)}',
+            result={1: 'passed', 0: 'failed', -1: 'skipped'}[result]
+        )
+
+def _sample_state(db_row):
+    if db_row is None:
+        return None
+    return db_row['sample_seed'], db_row['sample_round']
+
+def should_validate_file(file_stat, db_row):
     if db_row is None or db_row['status'] == 'failed':
         return True
+    inode, mtime_ns, size = file_stat
+    if size != db_row['file_size']:
+        return True
+    if db_row['file_mtime_ns'] is not None:
+        return mtime_ns != db_row['file_mtime_ns'] or (
+            db_row['file_inode'] is not None and inode != db_row['file_inode']
+        )
+    # Rows written before nanosecond mtimes were stored only have the float mtime
+    return db_row['file_mtime'] is None or abs(mtime_ns / 1e9 - db_row['file_mtime']) > 1e-6
+
+def _content_fingerprint(filepath, size):
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(filepath, 'rb') as f:
+        if size <= 3 * FINGERPRINT_CHUNK:
+            digest.update(f.read())
+        else:
+            for offset in (0, size // 2 - FINGERPRINT_CHUNK // 2, size - FINGERPRINT_CHUNK):
+                f.seek(offset)
+                digest.update(f.read(FINGERPRINT_CHUNK))
+    return digest.hexdigest()
+
+def _claim_moved_result(conn, m_type, filepath, file_stat):
+    # A new path whose size matches a row for a file that no longer exists is fingerprinted;
+    # on a match the old result is moved to the new path instead of validating it again
+    inode, mtime_ns, size = file_stat
+    candidates = [row for row in conn.execute('''
+        SELECT filepath, status, content_hash, file_inode FROM validation_results
+        WHERE file_size = ? AND content_hash IS NOT NULL AND filepath != ?
+    ''', (size, filepath)) if not os.path.exists(row['filepath'])]
+    if not candidates:
+        return None
     try:
-        current_mtime = os.path.getmtime(filepath)
-        current_size = os.path.getsize(filepath)
-        if (current_mtime != db_row['file_mtime'] or current_size != db_row['file_size']):
-            return True
-    except Exception:
+        fingerprint = _content_fingerprint(filepath, size)
+    except OSError as e:
+        app.logger.warning(f"Could not fingerprint {filepath}: {e}")
+        return None
+    matches = [row for row in candidates if row['content_hash'] == fingerprint]
+    # The fingerprint only covers part of the file, so copies with the same edges are told
+    # apart by inode (a rename keeps it) and are otherwise left to be validated
+    same_inode = [row for row in matches if row['file_inode'] == inode]
+    if same_inode:
+        matches = same_inode
+    if len(matches) != 1:
+        return None
+    row = matches[0]
+    with conn:
+        conn.execute('''
+            UPDATE validation_results
+            SET filepath = ?, media_type = ?, file_mtime = ?, file_mtime_ns = ?, file_inode = ?
+            WHERE filepath = ?
+        ''', (filepath, m_type, mtime_ns / 1e9, mtime_ns, inode, row['filepath']))
+        conn.execute('UPDATE failure_timeline SET filepath = ? WHERE filepath = ?', (filepath, row['filepath']))
+    app.logger.info(f"Carried over {row['status']} result from {row['filepath']} to {filepath}")
+    return row
+
+def _snapshot_library(base_paths, extensions, cancel_event=None, check_mounts=True):
+    # One scandir pass with a single stat per video file: path -> (inode, mtime_ns, size).
+    # check_mounts is off for subdirectories, which may legitimately be empty
+    snapshot = {}
+    complete = True
+    pending = list(base_paths)
+    while pending:
+        if cancel_event is not None and cancel_event.is_set():
+            return snapshot, False
+        directory = pending.pop()
+        try:
+            with os.scandir(directory) as entries:
+                entries = list(entries)
+                # An empty library root is usually a share that is not mounted, not a library
+                # whose files were all deleted
+                if check_mounts and not entries and directory in base_paths:
+                    app.logger.warning(f"Library path {directory} is empty; is it mounted?")
+                    complete = False
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        elif os.path.splitext(entry.name)[1].lower() in extensions and entry.is_file():
+                            file_stat = entry.stat()
+                            snapshot[entry.path] = (file_stat.st_ino, file_stat.st_mtime_ns, file_stat.st_size)
+                    except OSError as e:
+                        app.logger.error(f"Error accessing {entry.path}: {e}")
+        except OSError as e:
+            app.logger.error(f"Error reading directory {directory}: {e}")
+            complete = False
+    return snapshot, complete
+
+def _load_library_rows(media_type):
+    conn = get_db_connection()
+    try:
+        return {row['filepath']: row for row in conn.execute('''
+            SELECT filepath, status, file_mtime, file_mtime_ns, file_size, file_inode, last_checked,
+                   sample_seed, sample_round
+            FROM validation_results
+            WHERE media_type = ?
+        ''', (media_type,))}
+    finally:
+        conn.close()
+
+def _diff_snapshot(snapshot, db_rows):
+    new_files = []
+    changed_files = []
+    for filepath, file_stat in snapshot.items():
+        db_row = db_rows.get(filepath)
+        if db_row is None:
+            new_files.append(filepath)
+        elif should_validate_file(file_stat, db_row):
+            changed_files.append(filepath)
+    deleted_files = [filepath for filepath in db_rows if filepath not in snapshot]
+    return new_files, changed_files, deleted_files
+
+def _repair_strategies(filepath):
+    # (number, name, ffmpeg arguments between input and output, timeout, CPU heavy)
+    return [
+        (1, 'Container rebuild', ['-fflags', '+genpts', '-i', filepath, '-c', 'copy'], 300, False),
+        (2, 'Error recovery', ['-fflags', 'discardcorrupt', '-i', filepath, '-c', 'copy'], 600, False),
+        (3, 'Re-encoding', [
+            '-i', filepath,
+            '-c:v', 'libx264', '-crf', '23',
+            '-c:a', 'aac',
+            '-movflags', '+faststart'
+        ], 1800, True)
+    ]
+
+def _backup_path(filepath):
+    return os.path.join(os.path.dirname(filepath), '.video_backups', f"{os.path.basename(filepath)}.backup")
+
+def _create_backup(filepath, backup_path):
+    # Prefer copies that share data blocks with the original and only stream the bytes as a last resort
+    try:
+        with open(filepath, 'rb') as src, open(backup_path, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        shutil.copystat(filepath, backup_path)
+        return 'reflink'
+    except OSError:
+        if os.path.exists(backup_path):
+            os.remove(backup_path)
+    try:
+        # Safe because repairs never write into the original; they rename a new file over it
+        os.link(filepath, backup_path)
+        return 'hardlink'
+    except OSError:
         pass
-    return False
+    shutil.copy2(filepath, backup_path)
+    return 'copy'
 
-def repair_video_file(filepath):
-    app.logger.info(f"Starting repair for: {filepath}")
+def _record_backup(filepath, backup_path):
+    # After a successful repair the backup holds the only copy of the original data
+    try:
+        size = os.path.getsize(backup_path)
+    except OSError:
+        return
+    conn = get_thread_db_connection()
+    with conn:
+        conn.execute('''
+            INSERT OR REPLACE INTO repair_backups (backup_path, filepath, size, created_at)
+            VALUES (?, ?, ?, ?)
+        ''', (backup_path, filepath, size, datetime.now()))
+    _enforce_backup_retention(conn)
+
+def _enforce_backup_retention(conn):
+    expired = []
+    if BACKUP_RETENTION_DAYS > 0:
+        cutoff = datetime.now() - timedelta(days=BACKUP_RETENTION_DAYS)
+        expired = [row['backup_path'] for row in conn.execute(
+            'SELECT backup_path FROM repair_backups WHERE created_at < ?', (cutoff,)
+        )]
+    if BACKUP_MAX_GB > 0:
+        budget = BACKUP_MAX_GB * 1024 ** 3
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM repair_backups').fetchone()[0]
+        for row in conn.execute('SELECT backup_path, size FROM repair_backups ORDER BY created_at'):
+            if total <= budget:
+                break
+            if row['backup_path'] not in expired:
+                expired.append(row['backup_path'])
+            total -= row['size']
+    for backup_path in expired:
+        try:
+            if os.path.exists(backup_path):
+                os.remove(backup_path)
+            app.logger.info(f"Evicted backup: {backup_path}")
+        except OSError as e:
+            app.logger.error(f"Could not evict backup {backup_path}: {e}")
+            continue
+        with conn:
+            conn.execute('DELETE FROM repair_backups WHERE backup_path = ?', (backup_path,))
+
+def _prepare_repair(filepath):
     if not os.path.exists(filepath):
         app.logger.error(f"File not found: {filepath}")
-        return "failed", "File not found"
+        return "File not found", None
     if not os.access(filepath, os.R_OK):
         app.logger.error(f"Cannot read file: {filepath}")
-        return "failed", "Cannot read file"
+        return "Cannot read file", None
     dir_path = os.path.dirname(filepath)
     if not os.access(dir_path, os.W_OK):
         app.logger.error(f"Cannot write to directory: {dir_path}")
-        return "failed", "Cannot write to directory"
-    backup_dir = os.path.join(dir_path, '.video_backups')
-    filename = os.path.basename(filepath)
-    backup_path = os.path.join(backup_dir, f"{filename}.backup")
+        return "Cannot write to directory", None
+    backup_path = _backup_path(filepath)
     # Mark repair attempt in DB
-    conn = get_db_connection()
-    conn.execute('''
-        UPDATE validation_results
-        SET repair_attempted = ?, repair_success = NULL
-        WHERE filepath = ?
-    ''', (datetime.now(), filepath))
-    conn.commit()
-    conn.close()
+    conn = get_thread_db_connection()
+    with conn:
+        conn.execute('''
+            UPDATE validation_results
+            SET repair_attempted = ?, repair_success = NULL
+            WHERE filepath = ?
+        ''', (datetime.now(), filepath))
+    os.makedirs(os.path.dirname(backup_path), mode=0o755, exist_ok=True)
+    if not os.path.exists(backup_path):
+        method = _create_backup(filepath, backup_path)
+        app.logger.info(f"Created backup ({method}): {backup_path}")
     try:
-        os.makedirs(backup_dir, mode=0o755, exist_ok=True)
-        app.logger.info(f"Created backup directory: {backup_dir}")
-        if not os.path.exists(backup_path):
-            shutil.copy2(filepath, backup_path)
-            app.logger.info(f"Created backup: {backup_path}")
-        try:
-            subprocess.run(['ffmpeg', '-version'], capture_output=True, timeout=5)
-        except (subprocess.TimeoutExpired, FileNotFoundError) as e:
-            app.logger.error(f"FFmpeg not available: {e}")
-            return "failed", "FFmpeg not available"
-        # Strategy 1: Container rebuild
-        temp_path1 = filepath + ".repair1.tmp"
-        container_cmd = [
-            'ffmpeg', '-y', '-v', 'error',
-            '-i', filepath,
-            '-c', 'copy',
-            temp_path1
-        ]
-        app.logger.info(f"Attempting container rebuild: {' '.join(container_cmd)}")
-        try:
-            subprocess.run(container_cmd, check=True, timeout=300, capture_output=True, text=True)
-            if os.path.exists(temp_path1) and os.path.getsize(temp_path1) > 0:
-                shutil.move(temp_path1, filepath)
-                app.logger.info(f"Repaired using container rebuild: {filepath}")
-                _update_repair_status(filepath, True)
-                return "success", "Container rebuild successful"
-        except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
-            if os.path.exists(temp_path1):
-                os.remove(temp_path1)
-        # Strategy 2: Error recovery
-        temp_path2 = filepath + ".repair2.tmp"
-        recovery_cmd = [
-            'ffmpeg', '-y', '-v', 'error',
-            '-fflags', 'discardcorrupt',
-            '-i', filepath,
-            '-c', 'copy',
-            temp_path2
-        ]
-        app.logger.info(f"Attempting error recovery: {' '.join(recovery_cmd)}")
+        subprocess.run(['ffmpeg', '-version'], capture_output=True, timeout=5)
+    except (subprocess.TimeoutExpired, FileNotFoundError) as e:
+        app.logger.error(f"FFmpeg not available: {e}")
+        return "FFmpeg not available", backup_path
+    return None, backup_path
+
+def _run_repair_strategies(filepath, strategies):
+    # The temporary file has no media extension, so the muxer is named explicitly
+    output_format = OUTPUT_FORMATS.get(os.path.splitext(filepath)[1].lower(), 'matroska')
+    for index, name, args, timeout, heavy in strategies:
+        temp_path = filepath + f".repair{index}.tmp"
+        cmd = ['ffmpeg', '-y', '-v', 'error'] + args + ['-f', output_format, temp_path]
+        app.logger.info(f"Attempting {name.lower()}: {' '.join(cmd)}")
+        started = time.perf_counter()
+        outcome = 'failed'
         try:
-            subprocess.run(recovery_cmd, check=True, timeout=600, capture_output=True, text=True)
-            if os.path.exists(temp_path2) and os.path.getsize(temp_path2) > 0:
-                shutil.move(temp_path2, filepath)
-                app.logger.info(f"Repaired using error recovery: {filepath}")
-                _update_repair_status(filepath, True)
-                return "success", "Error recovery successful"
-        except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
-            if os.path.exists(temp_path2):
-                os.remove(temp_path2)
-        # Strategy 3: Re-encoding
-        temp_path3 = filepath + ".repair3.tmp"
-        reencode_cmd = [
-            'ffmpeg', '-y', '-v', 'error',
-            '-i', filepath,
-            '-c:v', 'libx264', '-crf', '23',
-            '-c:a', 'aac',
-            '-movflags', '+faststart',
-            temp_path3
-        ]
-        app.logger.info(f"Attempting re-encoding: {' '.join(reencode_cmd)}")
+            subprocess.run(cmd, check=True, timeout=timeout, capture_output=True, text=True)
+            if os.path.exists(temp_path) and os.path.getsize(temp_path) > 0:
+                # Atomic rename: a hardlinked backup keeps the original inode alive
+                os.replace(temp_path, filepath)
+                outcome = 'success'
+        except subprocess.TimeoutExpired:
+            outcome = 'timeout'
+        except subprocess.CalledProcessError:
+            pass
+        _metric_observe('validator_repair_seconds', time.perf_counter() - started, strategy=name)
+        _metric_inc('validator_repair_attempts_total', strategy=name, outcome=outcome)
+        if outcome == 'success':
+            app.logger.info(f"Repaired using {name.lower()}: {filepath}")
+            _update_repair_status(filepath, True)
+            return f"{name} successful"
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return None
+
+def _fail_repair(filepath, backup_path):
+    # If all repair strategies failed, delete the backup
+    if backup_path and os.path.exists(backup_path):
         try:
-            subprocess.run(reencode_cmd, check=True, timeout=1800, capture_output=True, text=True)
-            if os.path.exists(temp_path3) and os.path.getsize(temp_path3) > 0:
-                shutil.move(temp_path3, filepath)
-                app.logger.info(f"Repaired using re-encoding: {filepath}")
-                _update_repair_status(filepath, True)
-                return "success", "Re-encoding successful"
-        except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
-            if os.path.exists(temp_path3):
-                os.remove(temp_path3)
-        # If all repair strategies failed, delete the backup
-        if os.path.exists(backup_path):
-            try:
-                os.remove(backup_path)
-                app.logger.info(f"Deleted backup after failed repair: {backup_path}")
-            except Exception as e:
-                app.logger.error(f"Could not delete backup after failed repair: {e}")
-        else:
-            app.logger.info(f"No backup found to delete after failed repair: {backup_path}")
-        _update_repair_status(filepath, False)
+            os.remove(backup_path)
+            app.logger.info(f"Deleted backup after failed repair: {backup_path}")
+        except Exception as e:
+            app.logger.error(f"Could not delete backup after failed repair: {e}")
+    _update_repair_status(filepath, False)
+
+def _diagnose_fault(errors):
+    for diagnosis, pattern in FAULT_PATTERNS:
+        if pattern.search(errors or ''):
+            return diagnosis
+    return 'unknown'
+
+def _stored_errors(filepath):
+    row = get_thread_db_connection().execute(
+        'SELECT errors FROM validation_results WHERE filepath = ?', (filepath,)
+    ).fetchone()
+    return row['errors'] if row else None
+
+def repair_video_file(filepath, heavy=None):
+    # heavy=False runs only the stream-copy strategies, heavy=True only the re-encode
+    app.logger.info(f"Starting repair for: {filepath}")
+    backup_path = _backup_path(filepath)
+    try:
+        diagnosis = _diagnose_fault(_stored_errors(filepath))
+        wanted = [s for s in _repair_strategies(filepath) if s[0] in FAULT_STRATEGIES[diagnosis]]
+        if not heavy:
+            app.logger.info(f"Diagnosed {diagnosis} fault, strategies {[s[1] for s in wanted] or 'none'}: {filepath}")
+            _metric_inc('validator_repair_diagnoses_total', diagnosis=diagnosis)
+        if not wanted:
+            _update_repair_status(filepath, False)
+            return "failed", f"Not repairable: {diagnosis.replace('_', ' ')}"
+        if not heavy:
+            error, prepared_backup = _prepare_repair(filepath)
+            if error:
+                if prepared_backup:
+                    _fail_repair(filepath, prepared_backup)
+                return "failed", error
+        strategies = [strategy for strategy in wanted if heavy is None or strategy[4] == heavy]
+        message = _run_repair_strategies(filepath, strategies)
+        if message:
+            _record_backup(filepath, backup_path)
+            return "success", message
+        if heavy is False and any(strategy[4] for strategy in wanted):
+            return "pending", "Stream copy strategies failed"
+        _fail_repair(filepath, backup_path)
         return "failed", "All repair strategies failed"
     except Exception as e:
         app.logger.error(f"Repair exception for {filepath}: {e}")
-        if os.path.exists(backup_path):
-            try:
-                os.remove(backup_path)
-                app.logger.info(f"Deleted backup after failed repair: {backup_path}")
-            except Exception as e2:
-                app.logger.error(f"Could not delete backup after failed repair: {e2}")
-        _update_repair_status(filepath, False)
+        _fail_repair(filepath, backup_path)
         return "failed", f"Exception: {e}"
 
 def _update_repair_status(filepath, success):
-    conn = get_db_connection()
-    conn.execute('''
-        UPDATE validation_results
-        SET repair_success = ?
-        WHERE filepath = ?
-    ''', (1 if success else 0, filepath))
-    conn.commit()
-    conn.close()
+    conn = get_thread_db_connection()
+    with conn:
+        conn.execute('''
+            UPDATE validation_results
+            SET repair_success = ?
+            WHERE filepath = ?
+        ''', (1 if success else 0, filepath))
+
+def _revalidate_repaired(filepath, media_type):
+    conn = get_thread_db_connection()
+    db_row = conn.execute('''
+        SELECT sample_seed, sample_round FROM validation_results WHERE filepath = ?
+    ''', (filepath,)).fetchone()
+    validation_status, errors, duration, checks = validate_video(
+        filepath, _library_config(media_type), _sample_state(db_row)
+    )
+    try:
+        file_stat = os.stat(filepath)
+        with conn:
+            conn.execute('''
+                UPDATE validation_results 
+                SET status = ?, errors = ?, duration = ?, 
+                    file_mtime = ?, file_size = ?, file_mtime_ns = ?, file_inode = ?,
+                    last_checked = ?,
+                    sample_seed = ?, sample_round = ?, content_hash = ?
+                WHERE filepath = ?
+            ''', (
+                validation_status, errors, duration,
+                file_stat.st_mtime, file_stat.st_size, file_stat.st_mtime_ns,
+                file_stat.st_ino, datetime.now(),
+                checks.get('sample_seed'), checks.get('sample_round', 0),
+                _content_fingerprint(filepath, file_stat.st_size),
+                filepath
+            ))
+            _write_checkpoints(conn, [(filepath, checks['checkpoints'])])
+            conn.execute('''
+                INSERT INTO failure_timeline (filepath, media_type, event_time, event, diagnosis)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (
+                filepath, media_type, datetime.now(), 'repaired' if validation_status == 'passed' else 'failed',
+                _diagnose_fault(errors) if errors else None
+            ))
+        app.logger.info(f"Updated validation for: {filepath} -> {validation_status}")
+    except Exception as e:
+        app.logger.error(f"Database update error: {e}")
+
+def _repair_snapshot():
+    with repair_lock:
+        return dict(repair_progress, workers={name: dict(w) for name, w in repair_progress['workers'].items()})
+
+def _publish_repair():
+    publish_event('repair', _repair_snapshot())
+
+def _set_repair_worker(name, filepath=None, stage=None):
+    with repair_lock:
+        if filepath is None:
+            repair_progress['workers'][name] = {'state': 'idle', 'file': '', 'stage': ''}
+        else:
+            repair_progress['workers'][name] = {
+                'state': 'working', 'file': os.path.basename(filepath), 'stage': stage
+            }
+            repair_progress['current_file'] = os.path.basename(filepath)
+    _publish_repair()
+
+def _repair_done(filepath, status, message):
+    app.logger.info(f"Repair result for {filepath}: {status} - {message}")
+    with repair_lock:
+        repair_progress['completed'] += 1
+        repair_progress['succeeded' if status == 'success' else 'failed'] += 1
+    _publish_repair()
+
+def _repair_worker(name, work_queue, heavy, reencode_queue=None):
+    _set_repair_worker(name)
+    while True:
+        _, filepath, media_type = work_queue.get()
+        if filepath is None:
+            break
+        with repair_lock:
+            repair_progress['queued_reencode' if heavy else 'queued_remux'] -= 1
+        _set_repair_worker(name, filepath, 're-encode' if heavy else 'remux')
+        try:
+            status, message = repair_video_file(filepath, heavy=heavy)
+            if status == 'pending':
+                # Hand off to the re-encode pool so cheap remux fixes keep flowing meanwhile
+                with repair_lock:
+                    repair_progress['queued_reencode'] += 1
+                reencode_queue.put((os.path.getsize(filepath), filepath, media_type))
+            else:
+                if status == 'success':
+                    _set_repair_worker(name, filepath, 'revalidate')
+                    _revalidate_repaired(filepath, media_type)
+                _repair_done(filepath, status, message)
+        except Exception as e:
+            app.logger.error(f"Repair worker error for {filepath}: {e}")
+            _repair_done(filepath, 'failed', f"Exception: {e}")
+        _set_repair_worker(name)
+    with repair_lock:
+        repair_progress['workers'][name]['state'] = 'stopped'
+    _publish_repair()
 
 def repair_all_failed_files():
-    global repair_progress
     with app.app_context():
         try:
             app.logger.info("Repair thread started")
             conn = get_db_connection()
             failed_files = conn.execute(
-                'SELECT filepath, media_type FROM validation_results WHERE status = "failed"'
+                'SELECT filepath, media_type, file_size FROM validation_results WHERE status = "failed"'
             ).fetchall()
             conn.close()
-            repair_progress['total'] = len(failed_files)
-            repair_progress['completed'] = 0
-            repair_progress['active'] = True
-            repair_progress['status'] = 'running'
-            app.logger.info(f"Found {len(failed_files)} failed files to repair")
+            # Smallest files first within each stage so quick fixes land early
+            remux_queue = queue.PriorityQueue()
+            reencode_queue = queue.PriorityQueue()
             for file_row in failed_files:
-                filepath = file_row['filepath']
-                media_type = file_row['media_type']
-                repair_progress['current_file'] = os.path.basename(filepath)
-                app.logger.info(f"Starting repair for: {filepath}")
-                test_dir = os.path.dirname(filepath)
-                try:
-                    test_file = os.path.join(test_dir, '.write_test')
-                    with open(test_file, 'w') as f:
-                        f.write('test')
-                    os.remove(test_file)
-                    app.logger.info(f"Write permissions confirmed for: {test_dir}")
-                except Exception as e:
-                    app.logger.error(f"Write permission denied for {test_dir}: {e}")
-                    continue
-                status, message = repair_video_file(filepath)
-                app.logger.info(f"Repair result for {filepath}: {status} - {message}")
-                if status == "success":
-                    validation_status, errors, duration, checks = validate_video(filepath, media_type)
-                    conn = get_db_connection()
-                    try:
-                        file_mtime = os.path.getmtime(filepath)
-                        file_size = os.path.getsize(filepath)
-                        conn.execute('''
-                            UPDATE validation_results 
-                            SET status = ?, errors = ?, duration = ?, 
-                                file_mtime = ?, file_size = ?, last_checked = ?,
-                                check_1m = ?, check_5m = ?, check_10m = ?, check_30m = ?
-                            WHERE filepath = ?
-                        ''', (
-                            validation_status, errors, duration,
-                            file_mtime, file_size, datetime.now(),
-                            checks.get('check_1m', 0), checks.get('check_5m', 0),
-                            checks.get('check_10m', 0), checks.get('check_30m', 0),
-                            filepath
-                        ))
-                        conn.commit()
-                        app.logger.info(f"Updated validation for: {filepath} -> {validation_status}")
-                    except Exception as e:
-                        app.logger.error(f"Database update error: {e}")
-                    finally:
-                        conn.close()
-                repair_progress['completed'] += 1
-                time.sleep(0.1)
+                remux_queue.put((file_row['file_size'] or 0, file_row['filepath'], file_row['media_type']))
+            with repair_lock:
+                repair_progress['total'] = len(failed_files)
+                repair_progress['completed'] = 0
+                repair_progress['queued_remux'] = len(failed_files)
+                repair_progress['active'] = True
+                repair_progress['status'] = 'running'
+            _publish_repair()
+            app.logger.info(f"Found {len(failed_files)} failed files to repair")
+            remux_workers = [
+                threading.Thread(
+                    target=_repair_worker, args=(f"remux-{i}", remux_queue, False, reencode_queue),
+                    name=f"RepairWorker-{i}", daemon=True
+                ) for i in range(max(1, REPAIR_WORKERS))
+            ]
+            reencode_workers = [
+                threading.Thread(
+                    target=_repair_worker, args=(f"reencode-{i}", reencode_queue, True),
+                    name=f"ReencodeWorker-{i}", daemon=True
+                ) for i in range(max(1, REENCODE_WORKERS))
+            ]
+            for _ in remux_workers:
+                remux_queue.put((float('inf'), None, None))
+            for worker in remux_workers + reencode_workers:
+                worker.start()
+            for worker in remux_workers:
+                worker.join()
+            for _ in reencode_workers:
+                reencode_queue.put((float('inf'), None, None))
+            for worker in reencode_workers:
+                worker.join()
         except Exception as e:
             app.logger.error(f"Repair thread error: {e}")
-            repair_progress['status'] = 'error'
+            with repair_lock:
+                repair_progress['status'] = 'error'
         finally:
-            repair_progress['active'] = False
-            repair_progress['status'] = 'completed'
+            with repair_lock:
+                repair_progress['active'] = False
+                repair_progress['status'] = 'completed'
+            _publish_repair()
             app.logger.info("Repair thread completed")
 
-def _run_scan(media_type=None, full_rescan=False):
+def _disk_sectors():
+    # Sectors read + written by whole block devices since boot (host-wide, also inside a container)
+    disks = {name for name in os.listdir('/sys/block') if not name.startswith(('loop', 'ram', 'zram'))}
+    total = 0
+    with open('/proc/diskstats') as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) > 9 and fields[2] in disks:
+                total += int(fields[5]) + int(fields[9])
+    return total
+
+def _host_busy():
+    now = time.monotonic()
+    with load_lock:
+        if now - load_state['checked_at'] < LOAD_CHECK_INTERVAL:
+            return load_state['busy']
+        load_state['checked_at'] = now
+        busy = False
+        if SCAN_MAX_LOAD > 0:
+            load_per_core = os.getloadavg()[0] / (os.cpu_count() or 1)
+            busy = load_per_core > SCAN_MAX_LOAD
+        if SCAN_IO_BUDGET_MBPS > 0:
+            try:
+                sectors = _disk_sectors()
+                previous = load_state['io_sample']
+                load_state['io_sample'] = (now, sectors)
+                if previous and now > previous[0]:
+                    mbps = (sectors - previous[1]) * 512 / (now - previous[0]) / 1e6
+                    busy = busy or mbps > SCAN_IO_BUDGET_MBPS
+            except OSError as e:
+                app.logger.warning(f"Cannot read disk statistics: {e}")
+        if busy != load_state['busy']:
+            app.logger.info("Host busy, pausing validation" if busy else "Host load back to normal, resuming validation")
+        load_state['busy'] = busy
+        return busy
+
+def _set_throttled(throttled):
+    with scan_lock:
+        changed = scan_progress['throttled'] != throttled
+        scan_progress['throttled'] = throttled
+    if changed:
+        _publish_scan()
+
+def _wait_for_capacity(cancel_event):
+    if SCAN_MAX_LOAD <= 0 and SCAN_IO_BUDGET_MBPS <= 0:
+        return
+    while _host_busy() and not cancel_event.is_set():
+        _set_throttled(True)
+        cancel_event.wait(LOAD_CHECK_INTERVAL)
+    _set_throttled(False)
+
+def _finished_since(db_row, resume_since):
+    # A file whose result was committed after the job first started was already handled by this run
+    return (resume_since is not None and db_row is not None and db_row['last_checked'] is not None
+            and str(db_row['last_checked']) >= str(resume_since))
+
+def _rotation_slice(snapshot, db_rows, candidates):
+    if SAMPLE_WINDOWS <= 0 or DEEP_SCAN or SAMPLE_ROTATION_SCANS <= 0:
+        return []
+    unchanged = sorted(
+        (str(db_rows[filepath]['last_checked']), filepath) for filepath in snapshot
+        if filepath not in candidates and db_rows.get(filepath) is not None
+        and db_rows[filepath]['status'] == 'passed'
+    )
+    count = -(-len(unchanged) // SAMPLE_ROTATION_SCANS)
+    return [filepath for _, filepath in unchanged[:count]]
+
+def _library_candidates(m_type, full_rescan, resume_since=None):
+    library = _library_config(m_type)
+    snapshot, complete = _snapshot_library(library['paths'], library['extensions'], scan_cancel_event)
+    db_rows = _load_library_rows(m_type)
+    new_files, changed_files, deleted_files = _diff_snapshot(snapshot, db_rows)
+    new_files, deleted_files = _claim_moved_files(m_type, snapshot, new_files, deleted_files)
+    app.logger.info(
+        f"{m_type.capitalize()} snapshot: {len(snapshot)} files, {len(new_files)} new, "
+        f"{len(changed_files)} changed, {len(deleted_files)} deleted"
+        + ("" if complete else " (incomplete walk)")
+    )
+    candidates = list(snapshot) if full_rescan else new_files + changed_files
+    if not full_rescan:
+        rotated = _rotation_slice(snapshot, db_rows, set(candidates))
+        if rotated:
+            app.logger.info(f"{m_type.capitalize()}: revalidating {len(rotated)} unchanged files to rotate samples")
+        candidates += rotated
+    jobs = [
+        (filepath, snapshot[filepath], _sample_state(db_rows.get(filepath)))
+        for filepath in candidates if not _finished_since(db_rows.get(filepath), resume_since)
+    ]
+    # Deletions are only trusted when every directory of the library could be read
+    return jobs, deleted_files if complete else None
+
+def _walk_library(m_type, full_rescan, job_queue, deleted_by_type, scan_counts, num_workers, resume_since=None):
+    try:
+        jobs, deleted_by_type[m_type] = _library_candidates(m_type, full_rescan, resume_since)
+        for job in jobs:
+            if scan_cancel_event.is_set():
+                break
+            scan_counts[m_type] += 1
+            with scan_lock:
+                scan_progress['total'] += 1
+            job_queue.put(job)
+    except Exception as e:
+        # The library is skipped, keeping its results, and the job is marked failed when it ends
+        app.logger.error(f"Scan of library {m_type} failed: {e}")
+        deleted_by_type[m_type] = None
+        with scan_lock:
+            scan_progress['walk_errors'] = scan_progress['walk_errors'] + [f"{m_type}: {e}"]
+    finally:
+        for _ in range(num_workers):
+            job_queue.put(None)
+
+def _claim_moved_files(m_type, snapshot, new_files, deleted_files):
+    if not new_files:
+        return new_files, deleted_files
+    conn = get_db_connection()
+    try:
+        unclaimed = []
+        claimed = set()
+        for filepath in new_files:
+            row = _claim_moved_result(conn, m_type, filepath, snapshot[filepath])
+            if row is None:
+                unclaimed.append(filepath)
+                continue
+            claimed.add(row['filepath'])
+            # Failed results are always revalidated, moved or not
+            if row['status'] == 'failed':
+                unclaimed.append(filepath)
+    finally:
+        conn.close()
+    return unclaimed, [filepath for filepath in deleted_files if filepath not in claimed]
+
+def _validation_worker(m_type, job_queue, result_queue, scan_slots, cancel_event=scan_cancel_event):
+    while True:
+        job = job_queue.get()
+        if job is None:
+            break
+        filepath, file_stat, sample_state = job
+        if cancel_event.is_set():
+            continue
+        _wait_for_capacity(cancel_event)
+        try:
+            with scan_slots:
+                started = time.perf_counter()
+                status, errors, duration, checks = validate_video(filepath, _library_config(m_type), sample_state)
+                _metric_observe('validator_validation_seconds', time.perf_counter() - started, media_type=m_type)
+            checks['content_hash'] = _content_fingerprint(filepath, file_stat[2])
+        except Exception as e:
+            app.logger.error(f"Validation error for {filepath}: {e}")
+            _metric_inc('validator_files_scanned_total', media_type=m_type, status='error')
+            continue
+        _metric_inc('validator_files_scanned_total', media_type=m_type, status=status)
+        result_queue.put((m_type, filepath, status, errors, duration, file_stat, checks))
+
+def _write_checkpoints(conn, results):
+    # results: (filepath, {checkpoint seconds: 1 passed, 0 failed, -1 beyond the end}). Keys
+    # arrive as strings when the checks came from a worker node as JSON
+    conn.executemany('''
+        DELETE FROM checkpoint_results
+        WHERE result_id = (SELECT id FROM validation_results WHERE filepath = ?)
+    ''', [(filepath,) for filepath, _ in results])
+    conn.executemany('''
+        INSERT INTO checkpoint_results (result_id, media_type, checkpoint, result)
+        SELECT id, media_type, ?, ? FROM validation_results WHERE filepath = ?
+    ''', [
+        (int(seconds), result, filepath)
+        for filepath, checkpoints in results for seconds, result in checkpoints.items()
+    ])
+
+def _record_outcomes(conn, batch, previous, now, history_id=None):
+    # Every failure goes on the file's timeline, and so does the pass that ends a run of failures
+    events = []
+    counts = {'passed': 0, 'failed': 0, 'new_failures': 0, 'fixed': 0}
+    for m_type, filepath, status, errors, *_ in batch:
+        counts[status] += 1
+        if status == 'failed':
+            counts['new_failures'] += previous.get(filepath) != 'failed'
+            events.append((filepath, m_type, now, 'failed', history_id, _diagnose_fault(errors)))
+        elif previous.get(filepath) == 'failed':
+            counts['fixed'] += 1
+            events.append((filepath, m_type, now, 'fixed', history_id, None))
+    conn.executemany('''
+        INSERT INTO failure_timeline (filepath, media_type, event_time, event, scan_id, diagnosis)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', events)
+    if history_id is not None:
+        conn.execute('''
+            UPDATE scan_history
+            SET total_files_scanned = total_files_scanned + ?, files_passed = files_passed + ?,
+                files_failed = files_failed + ?, new_failures = new_failures + ?, fixed_files = fixed_files + ?
+            WHERE id = ?
+        ''', (len(batch), counts['passed'], counts['failed'], counts['new_failures'], counts['fixed'], history_id))
+
+def _write_results(conn, batch, now, history_id=None):
+    # Read before INSERT OR REPLACE overwrites them, to tell new failures and fixes apart.
+    # Looked up in chunks so a large WRITE_BATCH_SIZE stays under SQLite's variable limit
+    filepaths = [result[1] for result in batch]
+    previous = {}
+    for start in range(0, len(filepaths), SQLITE_MAX_VARIABLES):
+        chunk = filepaths[start:start + SQLITE_MAX_VARIABLES]
+        previous.update(conn.execute(f'''
+            SELECT filepath, status FROM validation_results
+            WHERE filepath IN ({', '.join('?' * len(chunk))})
+        ''', chunk).fetchall())
+    conn.executemany('''
+        INSERT OR REPLACE INTO validation_results
+        (media_type, filepath, status, errors, duration, 
+         file_mtime, file_size, file_mtime_ns, file_inode, last_checked,
+         sample_seed, sample_round, content_hash)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(
+        m_type, filepath, status, errors, duration,
+        file_stat[1] / 1e9, file_stat[2], file_stat[1], file_stat[0], now,
+        checks.get('sample_seed'), checks.get('sample_round', 0), checks.get('content_hash')
+    ) for m_type, filepath, status, errors, duration, file_stat, checks in batch])
+    _write_checkpoints(conn, [(result[1], result[6]['checkpoints']) for result in batch])
+    _record_outcomes(conn, batch, previous, now, history_id)
+
+def _update_job_progress(conn, job_id, completed, total, current_file):
+    conn.execute('''
+        UPDATE scan_jobs SET completed_files = ?, total_files = ?, current_file = ?
+        WHERE id = ?
+    ''', (completed, total, current_file, job_id))
+
+def _flush_results(conn, batch, job_id=None, progress=None, history_id=None):
+    # Returns the results that made it to the database
+    if not batch:
+        return []
+    now = datetime.now()
+    with scan_lock:
+        completed = (progress['completed'] if progress is not None else 0) + len(batch)
+        total = progress['total'] if progress is not None else 0
+    started = time.perf_counter()
+    written = batch
+    try:
+        with conn:
+            _write_results(conn, batch, now, history_id)
+            if job_id is not None and progress is not None:
+                _update_job_progress(conn, job_id, completed, total, batch[-1][1])
+    except Exception as e:
+        # One bad row must not cost the whole batch, so retry each result in its own transaction
+        app.logger.error(f"Database write error for batch of {len(batch)} results, retrying one by one: {e}")
+        written = []
+        for result in batch:
+            try:
+                with conn:
+                    _write_results(conn, [result], now, history_id)
+                written.append(result)
+            except Exception as e:
+                app.logger.error(f"Database write error for {result[1]}: {e}")
+        if progress is not None:
+            with scan_lock:
+                progress['write_errors'] += len(batch) - len(written)
+        if job_id is not None and progress is not None:
+            try:
+                with conn:
+                    _update_job_progress(conn, job_id, completed, total, batch[-1][1])
+            except Exception as e:
+                app.logger.error(f"Could not update progress of scan job {job_id}: {e}")
+    _metric_observe('validator_db_commit_seconds', time.perf_counter() - started)
+    _metric_inc('validator_db_rows_written_total', len(written))
+    if progress is not None:
+        with scan_lock:
+            progress['completed'] = completed
+            progress['current_file'] = os.path.basename(batch[-1][1])
+        _publish_scan()
+    for result in written:
+        app.logger.info(f"Revalidated {'FAILED' if result[2]=='failed' else 'PASSED'}: {result[1]}")
+    return written
+
+def _result_writer(result_queue, job_id=None, progress=None, history_id=None):
     conn = get_db_connection()
-    db_files = {row['filepath']: row for row in conn.execute('SELECT * FROM validation_results')}
-    existing_files = set()
-    media_types_to_scan = [media_type] if media_type else MEDIA_PATHS.keys()
-    files_scanned_count = 0
+    batch = []
+    flush_at = 0
+    try:
+        while True:
+            try:
+                timeout = max(0, flush_at - time.monotonic()) if batch else None
+                result = result_queue.get(timeout=timeout)
+            except queue.Empty:
+                _flush_results(conn, batch, job_id, progress, history_id)
+                batch = []
+                continue
+            if result is None:
+                break
+            if not batch:
+                flush_at = time.monotonic() + WRITE_BATCH_INTERVAL
+            batch.append(result)
+            if len(batch) >= WRITE_BATCH_SIZE or time.monotonic() >= flush_at:
+                _flush_results(conn, batch, job_id, progress, history_id)
+                batch = []
+        _flush_results(conn, batch, job_id, progress, history_id)
+    finally:
+        conn.close()
+
+def _validate_libraries(media_types_to_scan, full_rescan, job_id=None, resume_since=None):
+    deleted_by_type = {}
+    scan_counts = {m_type: 0 for m_type in media_types_to_scan}
+    # Each mount gets its own worker count on top of the global scan_slots cap
+    result_queue = queue.Queue(maxsize=SCAN_WORKERS * 4)
+    writer = threading.Thread(
+        target=_result_writer, args=(result_queue, job_id, scan_progress, _scan_snapshot()['history_id']),
+        name="ScanWriter", daemon=True
+    )
+    writer.start()
+    threads = []
     for m_type in media_types_to_scan:
-        base_path = MEDIA_PATHS[m_type]
-        for root, dirs, files in os.walk(base_path):
-            for file in files:
-                if os.path.splitext(file)[1].lower() in VIDEO_EXTENSIONS:
-                    filepath = os.path.join(root, file)
-                    existing_files.add(filepath)
-                    db_row = db_files.get(filepath)
-                    if full_rescan or should_validate_file(filepath, db_row):
-                        files_scanned_count += 1
-                        try:
-                            file_mtime = os.path.getmtime(filepath)
-                            file_size = os.path.getsize(filepath)
-                        except Exception as e:
-                            app.logger.error(f"Error accessing {filepath}: {e}")
-                            continue
-                        status, errors, duration, checks = validate_video(filepath, m_type)
+        num_workers = max(1, _library_config(m_type)['workers'])
+        job_queue = queue.Queue(maxsize=num_workers * 2)
+        threads.append(threading.Thread(
+            target=_walk_library,
+            args=(m_type, full_rescan, job_queue, deleted_by_type, scan_counts, num_workers, resume_since),
+            name=f"ScanWalker-{m_type}",
+            daemon=True
+        ))
+        for i in range(num_workers):
+            threads.append(threading.Thread(
+                target=_validation_worker,
+                args=(m_type, job_queue, result_queue, scan_slots),
+                name=f"ScanWorker-{m_type}-{i}",
+                daemon=True
+            ))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result_queue.put(None)
+    writer.join()
+    return deleted_by_type, sum(scan_counts.values())
+
+def _delete_missing_rows(conn, deleted_by_type):
+    deleted_count = 0
+    for m_type, deleted_files in deleted_by_type.items():
+        if deleted_files is None:
+            app.logger.warning(
+                f"Skipping cleanup for library {m_type}: a path could not be read or is empty, keeping its results"
+            )
+            continue
+        if deleted_files:
+            with conn:
+                conn.executemany('''
+                    DELETE FROM validation_results
+                    WHERE filepath = ? AND media_type = ?
+                ''', [(filepath, m_type) for filepath in deleted_files])
+            deleted_count += len(deleted_files)
+    return deleted_count
+
+def _queue_work(conn, job_id, jobs_by_type):
+    with conn:
+        # Leftovers of an interrupted run of this job are re-derived from the new walk
+        conn.execute("DELETE FROM work_queue WHERE job_id IS ? AND status != 'done'", (job_id,))
+        conn.executemany('''
+            INSERT INTO work_queue
+            (job_id, media_type, filepath, file_inode, file_mtime_ns, file_size, sample_seed, sample_round)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (job_id, m_type, filepath, file_stat[0], file_stat[1], file_stat[2],
+             *(sample_state or (None, 0)))
+            for m_type, jobs in jobs_by_type.items() for filepath, file_stat, sample_state in jobs
+        ])
+
+def _lease_work(conn, owner, limit):
+    now = datetime.now()
+    # BEGIN IMMEDIATE takes the write lock first so two nodes cannot lease the same rows
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        rows = conn.execute('''
+            SELECT * FROM work_queue WHERE status = 'queued' ORDER BY id LIMIT ?
+        ''', (limit,)).fetchall()
+        conn.executemany('''
+            UPDATE work_queue SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1
+            WHERE id = ?
+        ''', [(owner, now + timedelta(seconds=LEASE_SECONDS), row['id']) for row in rows])
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    # Worker nodes do not share the coordinator's library settings, so each item carries them
+    return [{
+        'id': row['id'],
+        'media_type': row['media_type'],
+        'filepath': row['filepath'],
+        'file_size': row['file_size'],
+        'sample_state': [row['sample_seed'], row['sample_round']] if row['sample_seed'] is not None else None,
+        'checkpoints': _library_config(row['media_type'])['checkpoints'],
+        'checkpoint_timeout': _library_config(row['media_type'])['checkpoint_timeout']
+    } for row in rows]
+
+def _complete_work(conn, owner, results):
+    # The first result for a row wins; results for rows cancelled, already done or leased to
+    # another node since this owner's lease expired are dropped. Every completion also extends
+    # the owner's remaining leases, so a busy node keeps them
+    rows = {}
+    for result in results:
+        row = conn.execute('''
+            SELECT * FROM work_queue
+            WHERE id = ? AND (status = 'queued' OR (status = 'leased' AND lease_owner = ?))
+        ''', (result['id'], owner)).fetchone()
+        if row is not None:
+            rows[row['id']] = row
+    batch = []
+    batch_rows = {}
+    retry = []
+    for result in results:
+        row = rows.get(result['id'])
+        if row is None:
+            continue
+        if result.get('error'):
+            app.logger.warning(f"Worker {owner} could not validate {row['filepath']}: {result['error']}")
+            retry.append(row)
+            continue
+        file_stat = (row['file_inode'], row['file_mtime_ns'], row['file_size'])
+        batch.append((
+            row['media_type'], row['filepath'], result['status'], result['errors'],
+            result['duration'], file_stat, result['checks']
+        ))
+        batch_rows[row['filepath']] = row
+    # Only the running scan has work in the queue, so its history row gets the counts
+    written = _flush_results(conn, batch, history_id=_scan_snapshot()['history_id'])
+    done = [batch_rows.pop(result[1]) for result in written]
+    # Rows whose result could not be written go back to the queue with the failed validations
+    retry.extend(batch_rows.values())
+    with conn:
+        conn.executemany('''
+            UPDATE work_queue SET status = 'done', lease_owner = ?
+            WHERE id = ? AND (status = 'queued' OR (status = 'leased' AND lease_owner = ?))
+        ''', [(owner, row['id'], owner) for row in done])
+        # Rows that keep failing on every node are dropped; the next scan picks the file up again
+        conn.executemany('''
+            UPDATE work_queue SET status = CASE WHEN attempts >= ? THEN 'abandoned' ELSE 'queued' END,
+                                  lease_owner = NULL, lease_expires = NULL
+            WHERE id = ? AND (status = 'queued' OR (status = 'leased' AND lease_owner = ?))
+        ''', [(WORK_MAX_ATTEMPTS, row['id'], owner) for row in retry])
+        conn.execute('''
+            UPDATE work_queue SET lease_expires = ? WHERE lease_owner = ? AND status = 'leased'
+        ''', (datetime.now() + timedelta(seconds=LEASE_SECONDS), owner))
+    return len(written)
+
+def _expire_leases(conn):
+    with conn:
+        cursor = conn.execute('''
+            UPDATE work_queue SET status = CASE WHEN attempts >= ? THEN 'abandoned' ELSE 'queued' END,
+                                  lease_owner = NULL, lease_expires = NULL
+            WHERE status = 'leased' AND lease_expires < ?
+        ''', (WORK_MAX_ATTEMPTS, datetime.now()))
+    if cursor.rowcount:
+        app.logger.warning(f"Re-queued {cursor.rowcount} expired work leases")
+
+def _validate_work_item(item, local_path=None):
+    local_path = local_path or item['filepath']
+    try:
+        size = os.stat(local_path).st_size
+    except OSError as e:
+        return {'id': item['id'], 'error': str(e)}
+    sample_state = tuple(item['sample_state']) if item['sample_state'] else None
+    library = dict(
+        _library_config(item['media_type']),
+        checkpoints=item['checkpoints'], checkpoint_timeout=item['checkpoint_timeout']
+    )
+    status, errors, duration, checks = validate_video(local_path, library, sample_state)
+    checks['content_hash'] = _content_fingerprint(local_path, size)
+    return {
+        'id': item['id'],
+        'status': status,
+        # Error text refers to the path the coordinator knows the file by
+        'errors': errors.replace(local_path, item['filepath']),
+        'duration': duration,
+        'checks': checks
+    }
+
+def _local_work_worker(owner, scan_slots, done_event):
+    conn = get_db_connection()
+    try:
+        while not done_event.is_set() and not scan_cancel_event.is_set():
+            items = _lease_work(conn, owner, 1)
+            if not items:
+                done_event.wait(1)
+                continue
+            _wait_for_capacity(scan_cancel_event)
+            try:
+                with scan_slots:
+                    result = _validate_work_item(items[0])
+            except Exception as e:
+                app.logger.error(f"Validation error for {items[0]['filepath']}: {e}")
+                result = {'id': items[0]['id'], 'error': str(e)}
+            _complete_work(conn, owner, [result])
+    finally:
+        conn.close()
+
+def _validate_libraries_distributed(media_types_to_scan, full_rescan, job_id=None, resume_since=None):
+    deleted_by_type = {}
+    jobs_by_type = {}
+    for m_type in media_types_to_scan:
+        jobs_by_type[m_type], deleted_by_type[m_type] = _library_candidates(m_type, full_rescan, resume_since)
+    conn = get_db_connection()
+    try:
+        _queue_work(conn, job_id, jobs_by_type)
+        queued_total = sum(len(jobs) for jobs in jobs_by_type.values())
+        with scan_lock:
+            scan_progress['total'] = scan_progress['completed'] + queued_total
+            base_completed = scan_progress['completed']
+        _publish_scan()
+        app.logger.info(f"Queued {queued_total} files for distributed validation")
+        done_event = threading.Event()
+        workers = [
+            threading.Thread(
+                target=_local_work_worker, args=(f"{socket.gethostname()}-local-{i}", scan_slots, done_event),
+                name=f"LocalWorkWorker-{i}", daemon=True
+            ) for i in range(COORDINATOR_LOCAL_WORKERS)
+        ]
+        for worker in workers:
+            worker.start()
+        completed = 0
+        while not scan_cancel_event.is_set():
+            _expire_leases(conn)
+            counts = dict(conn.execute('''
+                SELECT status, COUNT(*) FROM work_queue WHERE job_id IS ? GROUP BY status
+            ''', (job_id,)).fetchall())
+            if counts.get('done', 0) != completed:
+                completed = counts.get('done', 0)
+                with scan_lock:
+                    scan_progress['completed'] = base_completed + completed
+                    total = scan_progress['total']
+                if job_id is not None:
+                    with conn:
                         conn.execute('''
-                            INSERT OR REPLACE INTO validation_results
-                            (media_type, filepath, status, errors, duration, 
-                             file_mtime, file_size, last_checked,
-                             check_1m, check_5m, check_10m, check_30m)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        ''', (
-                            m_type, filepath, status, errors, duration,
-                            file_mtime, file_size, datetime.now(),
-                            checks.get('check_1m', 0), checks.get('check_5m', 0),
-                            checks.get('check_10m', 0), checks.get('check_30m', 0)
-                        ))
-                        conn.commit()
-                        app.logger.info(f"Revalidated {'FAILED' if status=='failed' else 'PASSED'}: {filepath}")
-    # Calculate repaired and fixed files
-    repaired_count = conn.execute('''
-        SELECT COUNT(*) FROM validation_results
-        WHERE repair_success = 1
-        AND last_checked >= (SELECT MAX(scan_time) FROM scan_history)
-    ''').fetchone()[0]
-    
-    fixed_count = conn.execute('''
-        SELECT COUNT(*) FROM validation_results
-        WHERE status = 'passed'
-        AND last_checked >= (SELECT MAX(scan_time) FROM scan_history)
-        AND filepath IN (
-            SELECT filepath FROM validation_results 
-            WHERE status = 'failed' 
-            AND last_checked < (SELECT MAX(scan_time) FROM scan_history)
-        )
-    ''').fetchone()[0]
-    
-    # Update scan history with new counts
+                            UPDATE scan_jobs SET completed_files = ?, total_files = ? WHERE id = ?
+                        ''', (base_completed + completed, total, job_id))
+                _publish_scan()
+            if not counts.get('queued') and not counts.get('leased'):
+                break
+            scan_cancel_event.wait(1)
+        done_event.set()
+        for worker in workers:
+            worker.join()
+        with conn:
+            if scan_cancel_event.is_set():
+                conn.execute("UPDATE work_queue SET status = 'cancelled' WHERE job_id IS ? AND status != 'done'", (job_id,))
+            else:
+                conn.execute('DELETE FROM work_queue WHERE job_id IS ?', (job_id,))
+    finally:
+        conn.close()
+    return deleted_by_type, completed
+
+def _coordinator_request(path, payload):
+    headers = {'Content-Type': 'application/json'}
+    if WORKER_TOKEN:
+        headers['Authorization'] = f'Bearer {WORKER_TOKEN}'
+    req = urllib.request.Request(
+        COORDINATOR_URL.rstrip('/') + path, data=json.dumps(payload, default=str).encode(), headers=headers
+    )
+    with urllib.request.urlopen(req, timeout=30) as response:
+        return json.load(response)
+
+def _local_path(filepath):
+    for remote_prefix, local_prefix in PATH_MAP:
+        if filepath.startswith(remote_prefix):
+            return local_prefix + filepath[len(remote_prefix):]
+    return filepath
+
+def distributed_worker(name):
+    app.logger.info(f"Worker {name} leasing from {COORDINATOR_URL}")
+    while True:
+        try:
+            items = _coordinator_request('/api/work/lease', {'worker': name, 'limit': LEASE_BATCH_SIZE})['items']
+        except Exception as e:
+            app.logger.error(f"Worker {name} could not reach coordinator: {e}")
+            items = []
+        if not items:
+            time.sleep(WORK_POLL_INTERVAL)
+            continue
+        for item in items:
+            _wait_for_capacity(threading.Event())
+            try:
+                result = _validate_work_item(item, _local_path(item['filepath']))
+            except Exception as e:
+                result = {'id': item['id'], 'error': str(e)}
+            # Each file is reported on its own, which also renews the leases on the rest
+            try:
+                _coordinator_request('/api/work/complete', {'worker': name, 'results': [result]})
+            except Exception as e:
+                app.logger.error(f"Worker {name} could not report {item['filepath']}: {e}")
+
+def _start_scan_history(media_types_to_scan, full_rescan, job_id=None):
+    # A resumed job keeps adding to the history row it started
+    conn = get_db_connection()
+    try:
+        if job_id is not None:
+            row = conn.execute('SELECT id FROM scan_history WHERE job_id = ?', (job_id,)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE scan_history SET status = 'running' WHERE id = ?", (row['id'],))
+                conn.commit()
+                return row['id']
+        cursor = conn.execute('''
+            INSERT INTO scan_history (scan_time, scan_type, libraries, total_files_scanned, job_id, status)
+            VALUES (?, ?, ?, 0, ?, 'running')
+        ''', (
+            datetime.now(), "Full" if full_rescan else "Incremental",
+            ", ".join(_library_config(m_type)['label'] for m_type in media_types_to_scan), job_id
+        ))
+        conn.commit()
+        return cursor.lastrowid
+    finally:
+        conn.close()
+
+def _run_scan(media_type=None, full_rescan=False, job_id=None, resume_since=None):
+    # Disabled libraries, and libraries deleted since the job was queued, are skipped
+    media_types_to_scan = [m_type for m_type in _enabled_libraries() if media_type in (None, m_type)]
+    history_id = _start_scan_history(media_types_to_scan, full_rescan, job_id)
+    with scan_lock:
+        scan_progress['history_id'] = history_id
+    validate = _validate_libraries_distributed if NODE_ROLE == 'coordinator' else _validate_libraries
+    deleted_by_type, files_scanned_count = validate(
+        media_types_to_scan, full_rescan, job_id, resume_since
+    )
+    conn = get_db_connection()
+    try:
+        if scan_cancel_event.is_set():
+            # A partial walk must not be used for cleanup
+            with conn:
+                conn.execute('''
+                    UPDATE scan_history SET status = 'cancelled', finished_at = ? WHERE id = ?
+                ''', (datetime.now(), history_id))
+            app.logger.info("Scan cancelled")
+            return files_scanned_count
+        # Cleanup deleted files, scoped to the libraries that were scanned
+        deleted_count = _delete_missing_rows(conn, deleted_by_type)
+        app.logger.info(f"Removed {deleted_count} deleted files from database")
+        # A library whose walk raised was skipped, so the run as a whole failed
+        history_status = 'failed' if _scan_snapshot()['walk_errors'] else 'completed'
+        with conn:
+            # Repairs that succeeded since the previous scan started
+            conn.execute('''
+                UPDATE scan_history
+                SET status = ?, finished_at = ?, deleted_files = ?,
+                    repaired_files = (
+                        SELECT COUNT(*) FROM failure_timeline
+                        WHERE event = 'repaired' AND event_time >= COALESCE((
+                            SELECT MAX(scan_time) FROM scan_history
+                            WHERE scan_time < (SELECT scan_time FROM scan_history WHERE id = ?)
+                        ), '')
+                    )
+                WHERE id = ?
+            ''', (history_status, datetime.now(), deleted_count, history_id, history_id))
+    finally:
+        conn.close()
+    return files_scanned_count
+
+def _scan_snapshot():
+    with scan_lock:
+        return dict(scan_progress)
+
+def _scan_state():
+    with scan_lock:
+        return dict(scan_progress, queued=scan_queue['queued'])
+
+def _refresh_scan_queue(conn):
+    queued = conn.execute("SELECT COUNT(*) FROM scan_jobs WHERE status = 'queued'").fetchone()[0]
+    with scan_lock:
+        scan_queue['queued'] = queued
+
+def _publish_scan():
+    publish_event('scan', _scan_state())
+
+def enqueue_scan_job(media_type=None, full_rescan=False):
+    conn = get_db_connection()
+    existing = conn.execute('''
+        SELECT id FROM scan_jobs
+        WHERE status = 'queued' AND media_type IS ? AND full_rescan = ?
+    ''', (media_type, 1 if full_rescan else 0)).fetchone()
+    if existing:
+        job_id = existing['id']
+    else:
+        cursor = conn.execute('''
+            INSERT INTO scan_jobs (media_type, full_rescan, status, created_at)
+            VALUES (?, ?, 'queued', ?)
+        ''', (media_type, 1 if full_rescan else 0, datetime.now()))
+        conn.commit()
+        job_id = cursor.lastrowid
+        app.logger.info(f"Queued scan job {job_id} (media: {media_type or 'all'}, full: {full_rescan})")
+    _refresh_scan_queue(conn)
+    conn.close()
+    scan_job_wakeup.set()
+    _publish_scan()
+    return job_id
+
+def _recover_scan_jobs():
+    conn = get_db_connection()
+    cursor = conn.execute('''
+        UPDATE scan_jobs SET status = 'queued' WHERE status = 'running'
+    ''')
+    conn.execute('''
+        UPDATE scan_jobs SET status = 'cancelled', finished_at = ? WHERE status = 'cancelling'
+    ''', (datetime.now(),))
+    # History rows of requeued jobs are picked up again; any other running row was interrupted
     conn.execute('''
-        UPDATE scan_history
-        SET repaired_files = ?, fixed_files = ?
-        WHERE scan_time = (SELECT MAX(scan_time) FROM scan_history)
-    ''', (repaired_count, fixed_count))
+        UPDATE scan_history SET status = 'cancelled', finished_at = ?
+        WHERE status = 'running'
+        AND (job_id IS NULL OR job_id NOT IN (SELECT id FROM scan_jobs WHERE status = 'queued'))
+    ''', (datetime.now(),))
     conn.commit()
-    # Cleanup deleted files
-    deleted_count = 0
-    if existing_files:
-        placeholders = ','.join('?' for _ in existing_files)
-        cursor = conn.execute(f'''
-            DELETE FROM validation_results 
-            WHERE filepath NOT IN ({placeholders})
-        ''', tuple(existing_files))
-        conn.commit()
-        deleted_count = cursor.rowcount
-    app.logger.info(f"Removed {deleted_count} deleted files from database")
-    # Record scan history
-    scan_type = "Full" if full_rescan else "Incremental"
-    libraries = ", ".join([m.capitalize() for m in media_types_to_scan])
+    _refresh_scan_queue(conn)
+    conn.close()
+    if cursor.rowcount:
+        app.logger.info(f"Resuming {cursor.rowcount} interrupted scan job(s)")
+
+def _finish_scan_job(job_id, status, error=None):
+    progress = _scan_snapshot()
+    if progress['write_errors']:
+        write_error = f"{progress['write_errors']} results could not be written to the database"
+        error = f"{error}; {write_error}" if error else write_error
+    if progress['walk_errors']:
+        walk_error = f"libraries skipped after errors: {', '.join(progress['walk_errors'])}"
+        error = f"{error}; {walk_error}" if error else walk_error
+        if status == 'completed':
+            status = 'failed'
+    conn = get_db_connection()
     conn.execute('''
-        INSERT INTO scan_history (scan_time, scan_type, libraries, total_files_scanned)
-        VALUES (?, ?, ?, ?)
-    ''', (datetime.now(), scan_type, libraries, files_scanned_count))
+        UPDATE scan_jobs
+        SET status = ?, finished_at = ?, error = ?, completed_files = ?, total_files = ?
+        WHERE id = ?
+    ''', (status, datetime.now(), error, progress['completed'], progress['total'], job_id))
+    # A scan that raised leaves its history row running
+    conn.execute('''
+        UPDATE scan_history SET status = ?, finished_at = ? WHERE job_id = ? AND status = 'running'
+    ''', (status, datetime.now(), job_id))
     conn.commit()
+    _refresh_scan_queue(conn)
     conn.close()
-    return redirect(url_for('dashboard'))
+    return status
+
+def _run_scan_job(job):
+    job_id = job['id']
+    # started_at is kept across restarts so that a resumed job skips files it already finished
+    resume_since = job['started_at']
+    started_at = resume_since or datetime.now()
+    conn = get_db_connection()
+    conn.execute('''
+        UPDATE scan_jobs SET status = 'running', started_at = ? WHERE id = ?
+    ''', (started_at, job_id))
+    conn.commit()
+    _refresh_scan_queue(conn)
+    conn.close()
+    scan_cancel_event.clear()
+    # Updated in place: result writers hold a reference to scan_progress
+    with scan_lock:
+        scan_progress.update({
+            'active': True,
+            'job_id': job_id,
+            'media_type': job['media_type'],
+            'full_rescan': bool(job['full_rescan']),
+            'current_file': '',
+            'completed': job['completed_files'] if resume_since else 0,
+            'total': job['completed_files'] if resume_since else 0,
+            'status': 'running',
+            'throttled': False,
+            'history_id': None,
+            'write_errors': 0,
+            'walk_errors': []
+        })
+    app.logger.info(f"Starting scan job {job_id}" + (f" (resuming from {resume_since})" if resume_since else ""))
+    _publish_scan()
+    status = 'failed'
+    try:
+        _run_scan(job['media_type'], bool(job['full_rescan']), job_id, resume_since)
+        status = _finish_scan_job(job_id, 'cancelled' if scan_cancel_event.is_set() else 'completed')
+    except Exception as e:
+        app.logger.error(f"Scan job {job_id} failed: {e}")
+        _finish_scan_job(job_id, 'failed', str(e))
+        status = 'failed'
+    finally:
+        with scan_lock:
+            scan_progress['status'] = status
+            scan_progress['active'] = False
+            scan_progress['current_file'] = ''
+        _publish_scan()
+        app.logger.info(f"Scan job {job_id} finished: {status}")
+
+def scan_job_runner():
+    _recover_scan_jobs()
+    while True:
+        try:
+            conn = get_db_connection()
+            job = conn.execute('''
+                SELECT * FROM scan_jobs WHERE status = 'queued' ORDER BY id LIMIT 1
+            ''').fetchone()
+            conn.close()
+        except Exception as e:
+            app.logger.error(f"Scan job runner error: {e}")
+            job = None
+        if job is None:
+            scan_job_wakeup.wait(5)
+            scan_job_wakeup.clear()
+            continue
+        _run_scan_job(job)
+
+def cancel_scan_job(job_id=None):
+    progress = _scan_snapshot()
+    if job_id is None and progress['active']:
+        job_id = progress['job_id']
+    if job_id is None:
+        return False
+    conn = get_db_connection()
+    cursor = conn.execute('''
+        UPDATE scan_jobs SET status = 'cancelled', finished_at = ?
+        WHERE id = ? AND status = 'queued'
+    ''', (datetime.now(), job_id))
+    cancelled = cursor.rowcount > 0
+    if progress['active'] and progress['job_id'] == job_id:
+        conn.execute("UPDATE scan_jobs SET status = 'cancelling' WHERE id = ?", (job_id,))
+        with scan_lock:
+            scan_progress['status'] = 'cancelling'
+        scan_cancel_event.set()
+        cancelled = True
+    conn.commit()
+    _refresh_scan_queue(conn)
+    conn.close()
+    if cancelled:
+        _publish_scan()
+        app.logger.info(f"Cancel requested for scan job {job_id}")
+    return cancelled
+
+def _media_type_for_path(filepath):
+    for m_type in _enabled_libraries():
+        for base_path in libraries[m_type]['paths']:
+            if filepath.startswith(base_path.rstrip(os.sep) + os.sep):
+                return m_type
+    return None
+
+def _watch_note(filepath, file_stat=None):
+    m_type = _media_type_for_path(filepath)
+    if m_type is None or os.path.splitext(filepath)[1].lower() not in _library_config(m_type)['extensions']:
+        return
+    with watch_lock:
+        watch_pending[filepath] = (m_type, file_stat, time.monotonic())
+
+class MediaEventHandler(FileSystemEventHandler):
+    def _note(self, path, is_directory):
+        if is_directory:
+            # Files inside a directory moved into the library produce no events of their own
+            extensions = {ext for library in libraries.values() for ext in library['extensions']}
+            snapshot, _ = _snapshot_library([path], extensions, check_mounts=False)
+            for filepath in snapshot:
+                _watch_note(filepath)
+        else:
+            _watch_note(path)
+
+    def on_created(self, event):
+        self._note(event.src_path, event.is_directory)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            _watch_note(event.src_path)
+
+    def on_closed(self, event):
+        _watch_note(event.src_path)
+
+    def on_moved(self, event):
+        self._note(event.dest_path, event.is_directory)
+
+def _start_media_observer():
+    if Observer is None:
+        app.logger.warning("watchdog is not installed; watcher falls back to periodic walks only")
+        return None
+    observer = Observer()
+    observer.daemon = True
+    observer.start()
+    handler = MediaEventHandler()
+    # Paths added later are picked up by the periodic walks until the next restart
+    for base_path in [path for m_type in _enabled_libraries() for path in libraries[m_type]['paths']]:
+        try:
+            observer.schedule(handler, base_path, recursive=True)
+            app.logger.info(f"Watching {base_path} for changes")
+        except OSError as e:
+            app.logger.warning(f"Cannot watch {base_path} ({e}); relying on periodic walks")
+    return observer
+
+def _watch_walk():
+    deleted_by_type = {}
+    for m_type in _enabled_libraries():
+        library = libraries[m_type]
+        snapshot, complete = _snapshot_library(library['paths'], library['extensions'])
+        new_files, changed_files, deleted_files = _diff_snapshot(snapshot, _load_library_rows(m_type))
+        new_files, deleted_files = _claim_moved_files(m_type, snapshot, new_files, deleted_files)
+        deleted_by_type[m_type] = deleted_files if complete else None
+        for filepath in new_files + changed_files:
+            with watch_lock:
+                if filepath not in watch_pending:
+                    watch_pending[filepath] = (m_type, snapshot[filepath], time.monotonic())
+    conn = get_db_connection()
+    try:
+        deleted_count = _delete_missing_rows(conn, deleted_by_type)
+    finally:
+        conn.close()
+    if deleted_count:
+        app.logger.info(f"Watcher removed {deleted_count} deleted files from database")
+
+def _watch_queue(m_type, job_queues, result_queue):
+    # Workers for a library are started the first time one of its files is due, so libraries
+    # added on the Settings page are watched without a restart
+    if m_type not in job_queues:
+        job_queues[m_type] = queue.Queue()
+        for i in range(max(1, _library_config(m_type)['workers'])):
+            threading.Thread(
+                target=_validation_worker,
+                args=(m_type, job_queues[m_type], result_queue, scan_slots, threading.Event()),
+                name=f"WatchWorker-{m_type}-{i}",
+                daemon=True
+            ).start()
+    return job_queues[m_type]
+
+def _watch_dispatch(job_queues, result_queue):
+    # A file is only validated once its stat has stopped changing for WATCH_SETTLE_SECONDS
+    now = time.monotonic()
+    with watch_lock:
+        items = list(watch_pending.items())
+    conn = get_db_connection()
+    try:
+        for filepath, entry in items:
+            m_type, last_stat, since = entry
+            try:
+                st = os.stat(filepath)
+                file_stat = (st.st_ino, st.st_mtime_ns, st.st_size)
+            except OSError:
+                file_stat = None
+            with watch_lock:
+                if watch_pending.get(filepath) != entry:
+                    continue
+                if file_stat is None:
+                    del watch_pending[filepath]
+                    continue
+                if file_stat != last_stat:
+                    watch_pending[filepath] = (m_type, file_stat, now)
+                    continue
+                if now - since < WATCH_SETTLE_SECONDS:
+                    continue
+                del watch_pending[filepath]
+            db_row = conn.execute('''
+                SELECT filepath, status, file_mtime, file_mtime_ns, file_size, file_inode,
+                       sample_seed, sample_round
+                FROM validation_results WHERE filepath = ?
+            ''', (filepath,)).fetchone()
+            if db_row is None:
+                moved = _claim_moved_result(conn, m_type, filepath, file_stat)
+                if moved is not None and moved['status'] != 'failed':
+                    continue
+            if should_validate_file(file_stat, db_row):
+                app.logger.info(f"Watcher queued {filepath}")
+                _watch_queue(m_type, job_queues, result_queue).put(
+                    (filepath, file_stat, _sample_state(db_row))
+                )
+    finally:
+        conn.close()
+
+def media_watcher():
+    observer = _start_media_observer() if WATCH_MODE == 'auto' else None
+    walk_interval = WATCH_FULL_WALK_INTERVAL if observer is not None else WATCH_POLL_INTERVAL
+    result_queue = queue.Queue()
+    threading.Thread(target=_result_writer, args=(result_queue,), name="WatchWriter", daemon=True).start()
+    job_queues = {}
+    app.logger.info(f"Media watcher started (mode: {WATCH_MODE}, inotify: {observer is not None})")
+    next_walk = time.monotonic()
+    while True:
+        try:
+            # Pending files wait while a scan runs, so the two never validate the same file
+            if not _scan_snapshot()['active']:
+                if time.monotonic() >= next_walk:
+                    next_walk = time.monotonic() + walk_interval
+                    _watch_walk()
+                _watch_dispatch(job_queues, result_queue)
+        except Exception as e:
+            app.logger.error(f"Media watcher error: {e}")
+        time.sleep(5)
+
+def _stats_counters(conn):
+    # Zero counters left behind by deletions are not drift
+    counters = {
+        row['media_type']: tuple(row) for row in conn.execute('SELECT * FROM library_stats WHERE total != 0')
+    }
+    counters.update({
+        (row['media_type'], row['checkpoint']): row['failed']
+        for row in conn.execute('SELECT * FROM checkpoint_failures WHERE failed != 0')
+    })
+    return counters
+
+def reconcile_library_stats():
+    conn = get_db_connection()
+    try:
+        before = _stats_counters(conn)
+        with conn:
+            conn.execute('DELETE FROM library_stats')
+            conn.execute(LIBRARY_STATS_REBUILD)
+            conn.execute('DELETE FROM checkpoint_failures')
+            conn.execute(CHECKPOINT_FAILURES_REBUILD)
+        after = _stats_counters(conn)
+    finally:
+        conn.close()
+    if before != after:
+        app.logger.warning(f"Corrected dashboard statistics drift: {before} -> {after}")
+
+HISTORY_COUNTERS = [
+    'total_files_scanned', 'files_passed', 'files_failed', 'new_failures',
+    'fixed_files', 'repaired_files', 'deleted_files', 'scans_merged'
+]
+
+def compact_history():
+    conn = get_db_connection()
+    try:
+        now = datetime.now()
+        with conn:
+            if HISTORY_RETENTION_DAYS > 0:
+                conn.execute('DELETE FROM scan_history WHERE scan_time < ?', (now - timedelta(days=HISTORY_RETENTION_DAYS),))
+            if TIMELINE_RETENTION_DAYS > 0:
+                conn.execute('DELETE FROM failure_timeline WHERE event_time < ?', (now - timedelta(days=TIMELINE_RETENTION_DAYS),))
+        if HISTORY_DETAIL_DAYS <= 0:
+            return
+        # Older finished scans of the same kind are summed into one row per week
+        sums = ', '.join(f'SUM({column}) AS {column}' for column in HISTORY_COUNTERS)
+        groups = conn.execute(f'''
+            SELECT MIN(scan_time) AS scan_time, MAX(finished_at) AS finished_at, scan_type, libraries, status,
+                   {sums}, GROUP_CONCAT(id) AS ids
+            FROM scan_history
+            WHERE scan_time < ? AND status != 'running'
+            GROUP BY strftime('%Y-%W', scan_time), scan_type, libraries, status
+            HAVING COUNT(*) > 1
+        ''', (now - timedelta(days=HISTORY_DETAIL_DAYS),)).fetchall()
+        with conn:
+            for group in groups:
+                ids = [int(row_id) for row_id in group['ids'].split(',')]
+                conn.execute(f'''
+                    INSERT INTO scan_history
+                    (scan_time, finished_at, scan_type, libraries, status, {', '.join(HISTORY_COUNTERS)})
+                    VALUES (?, ?, ?, ?, ?, {', '.join('?' * len(HISTORY_COUNTERS))})
+                ''', (
+                    group['scan_time'], group['finished_at'], group['scan_type'], group['libraries'], group['status'],
+                    *(group[column] for column in HISTORY_COUNTERS)
+                ))
+                conn.executemany('DELETE FROM scan_history WHERE id = ?', [(row_id,) for row_id in ids])
+        if groups:
+            app.logger.info(f"Merged old scan history into {len(groups)} weekly rows")
+    finally:
+        conn.close()
+
+def _matches_occurrence(day, occurrence):
+    if occurrence == 'last':
+        return (day + timedelta(days=7)).month != day.month
+    if occurrence in OCCURRENCES:
+        return (day.day - 1) // 7 == OCCURRENCES.index(occurrence)
+    return (day.day - 1) // 7 == 0
+
+def next_scheduled_run(settings, after):
+    try:
+        hour, minute = (int(part) for part in str(settings['run_time']).split(':')[:2])
+    except ValueError:
+        hour, minute = 2, 0
+    # The settings form shows Monday when no day has been saved yet
+    weekday = WEEKDAYS.index(settings['day_of_week']) if settings['day_of_week'] in WEEKDAYS else 0
+    for offset in range(0, 400):
+        day = after.date() + timedelta(days=offset)
+        if day.weekday() != weekday:
+            continue
+        if settings['schedule_type'] == 'monthly' and not _matches_occurrence(day, settings['occurrence']):
+            continue
+        candidate = datetime.combine(day, datetime.min.time()).replace(hour=hour, minute=minute)
+        if candidate > after:
+            return candidate
+    return None
+
+def scan_scheduler():
+    next_reconcile = time.monotonic() + STATS_RECONCILE_INTERVAL
+    deferred_due = None
+    while True:
+        if time.monotonic() >= next_reconcile:
+            next_reconcile = time.monotonic() + STATS_RECONCILE_INTERVAL
+            try:
+                reconcile_library_stats()
+                compact_history()
+            except Exception as e:
+                app.logger.error(f"Statistics maintenance error: {e}")
+            # Age limits also have to apply while no repairs are recording new backups
+            try:
+                conn = get_db_connection()
+                try:
+                    _enforce_backup_retention(conn)
+                finally:
+                    conn.close()
+            except Exception as e:
+                app.logger.error(f"Backup retention error: {e}")
+        try:
+            conn = get_db_connection()
+            settings = conn.execute('SELECT * FROM app_settings').fetchone()
+            now = datetime.now()
+            if settings['last_scheduled_run'] is None:
+                conn.execute('UPDATE app_settings SET last_scheduled_run = ?', (now,))
+                conn.commit()
+            else:
+                last_run = datetime.fromisoformat(str(settings['last_scheduled_run']))
+                due = next_scheduled_run(settings, last_run)
+                if due is not None and due <= now:
+                    queued = conn.execute('''
+                        SELECT COUNT(*) FROM scan_jobs WHERE status IN ('queued', 'running', 'cancelling')
+                    ''').fetchone()[0]
+                    # A due run waits for the active scan instead of being dropped until the next period
+                    if queued or _scan_snapshot()['active']:
+                        if deferred_due != due:
+                            deferred_due = due
+                            app.logger.info(f"Scheduled scan due {due} will start once the active scan ends")
+                    else:
+                        app.logger.info(f"Starting scheduled scan due {due}")
+                        enqueue_scan_job(media_type=None, full_rescan=False)
+                        deferred_due = None
+                        conn.execute('UPDATE app_settings SET last_scheduled_run = ?', (now,))
+                        conn.commit()
+            conn.close()
+        except Exception as e:
+            app.logger.error(f"Scheduler error: {e}")
+        time.sleep(30)
+
+def start_background_services():
+    if NODE_ROLE == 'worker':
+        # Worker nodes only validate what the coordinator hands out
+        for i in range(max(1, SCAN_WORKERS)):
+            threading.Thread(
+                target=distributed_worker, args=(f"{socket.gethostname()}-{i}",),
+                name=f"DistributedWorker-{i}", daemon=True
+            ).start()
+        return
+    threading.Thread(target=scan_job_runner, name="ScanJobRunner", daemon=True).start()
+    threading.Thread(target=scan_scheduler, name="ScanScheduler", daemon=True).start()
+    if WATCH_MODE in ('auto', 'poll'):
+        threading.Thread(target=media_watcher, name="MediaWatcher", daemon=True).start()
 
 @app.route('/start-full-scan', methods=['POST'])
 def start_full_scan():
-    return _run_scan(media_type=None, full_rescan=False)
+    enqueue_scan_job(media_type=None, full_rescan=False)
+    return redirect(url_for('dashboard'))
+
+@app.route('/start-library-scan/<name>', methods=['POST'])
+def start_library_scan(name):
+    if name not in libraries:
+        return jsonify({'error': 'Unknown library'}), 404
+    if not libraries[name]['enabled']:
+        return jsonify({'error': 'Library is disabled'}), 409
+    enqueue_scan_job(media_type=name, full_rescan=False)
+    return redirect(url_for('dashboard'))
 
+# Kept for scripts and bookmarks that predate configurable libraries
 @app.route('/start-movies-scan', methods=['POST'])
 def start_movies_scan():
-    return _run_scan(media_type='movie', full_rescan=False)
+    return start_library_scan('movie')
 
 @app.route('/start-tv-scan', methods=['POST'])
 def start_tv_scan():
-    return _run_scan(media_type='tv', full_rescan=False)
+    return start_library_scan('tv')
 
 @app.route('/rescan-all', methods=['POST'])
 def rescan_all():
-    return _run_scan(media_type=None, full_rescan=True)
+    enqueue_scan_job(media_type=None, full_rescan=True)
+    return redirect(url_for('dashboard'))
+
+@app.route('/scan-progress')
+def get_scan_progress():
+    return jsonify(_scan_state())
+
+def _sse_message(event_id, kind, payload):
+    return f"id: {event_id}\nevent: {kind}\ndata: {payload}\n\n"
+
+def _state_messages():
+    with event_condition:
+        event_id = event_state['last_id']
+    return event_id, [
+        _sse_message(event_id, 'scan', json.dumps(_scan_state(), default=str)),
+        _sse_message(event_id, 'repair', json.dumps(_repair_snapshot(), default=str))
+    ]
+
+@app.route('/events')
+def events():
+    # Server-Sent Events: scan and repair progress pushed when it changes. A reconnecting
+    # EventSource sends Last-Event-ID and gets the missed events replayed from the buffer
+    try:
+        last_id = int(request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or -1)
+    except ValueError:
+        last_id = -1
+
+    def stream(last_id):
+        yield 'retry: 3000\n\n'
+        if last_id < 0:
+            last_id, messages = _state_messages()
+            yield from messages
+        while True:
+            pending, complete = _events_after(last_id, EVENT_KEEPALIVE)
+            if not complete:
+                # Fell behind the replay buffer or the server restarted: resend the current state
+                last_id, messages = _state_messages()
+                yield from messages
+                continue
+            if not pending:
+                yield ': keepalive\n\n'
+                continue
+            for event_id, kind, payload in pending:
+                yield _sse_message(event_id, kind, payload)
+                last_id = event_id
+
+    return Response(stream(last_id), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+def _worker_authorized():
+    return not WORKER_TOKEN or request.headers.get('Authorization') == f'Bearer {WORKER_TOKEN}'
+
+@app.route('/api/work/lease', methods=['POST'])
+def lease_work():
+    if NODE_ROLE != 'coordinator':
+        return jsonify({'error': 'Not a coordinator'}), 404
+    if not _worker_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    payload = request.get_json(force=True, silent=True) or {}
+    if not isinstance(payload, dict) or not payload.get('worker'):
+        return jsonify({'error': 'Missing worker'}), 400
+    try:
+        limit = max(1, min(int(payload.get('limit', 1)), 100))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid limit'}), 400
+    conn = get_db_connection()
+    try:
+        items = _lease_work(conn, str(payload['worker']), limit)
+    finally:
+        conn.close()
+    return jsonify({'lease_seconds': LEASE_SECONDS, 'items': items})
+
+def _invalid_work_result(result):
+    # Checked up front so one malformed result cannot fail the whole batch write
+    if not isinstance(result, dict):
+        return 'not an object'
+    if not isinstance(result.get('id'), int) or isinstance(result['id'], bool):
+        return 'id must be an integer'
+    if 'error' in result:
+        return None if isinstance(result['error'], str) else 'error must be a string'
+    if result.get('status') not in ('passed', 'failed'):
+        return "status must be 'passed' or 'failed'"
+    if not isinstance(result.get('errors'), str):
+        return 'errors must be a string'
+    if not isinstance(result.get('duration'), (int, float)) or isinstance(result['duration'], bool):
+        return 'duration must be a number'
+    checks = result.get('checks')
+    if not isinstance(checks, dict) or not isinstance(checks.get('checkpoints'), dict):
+        return 'checks.checkpoints must be an object'
+    if not all(str(seconds).isdigit() and value in (-1, 0, 1) for seconds, value in checks['checkpoints'].items()):
+        return 'checkpoint results must map seconds to -1, 0 or 1'
+    return None
+
+@app.route('/api/work/complete', methods=['POST'])
+def complete_work():
+    if NODE_ROLE != 'coordinator':
+        return jsonify({'error': 'Not a coordinator'}), 404
+    if not _worker_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    payload = request.get_json(force=True, silent=True) or {}
+    if not isinstance(payload, dict) or not payload.get('worker'):
+        return jsonify({'error': 'Missing worker'}), 400
+    results = payload.get('results', [])
+    if not isinstance(results, list):
+        return jsonify({'error': 'Invalid results'}), 400
+    for index, result in enumerate(results):
+        problem = _invalid_work_result(result)
+        if problem:
+            return jsonify({'error': f'Invalid result {index}: {problem}'}), 400
+    conn = get_db_connection()
+    try:
+        accepted = _complete_work(conn, str(payload['worker']), results)
+    finally:
+        conn.close()
+    return jsonify({'accepted': accepted})
+
+@app.route('/metrics')
+def metrics():
+    if not METRICS_ENABLED:
+        return Response('Metrics are disabled; set METRICS_ENABLED=1\n', status=404, mimetype='text/plain')
+    # Queue depths are read from the progress state at scrape time instead of on every put/get
+    progress = _scan_state()
+    _metric_set('validator_queue_depth', progress['queued'], queue='scan_jobs')
+    _metric_set('validator_queue_depth', max(0, progress['total'] - progress['completed']), queue='scan')
+    with repair_lock:
+        _metric_set('validator_queue_depth', repair_progress['queued_remux'], queue='repair_remux')
+        _metric_set('validator_queue_depth', repair_progress['queued_reencode'], queue='repair_reencode')
+    with watch_lock:
+        _metric_set('validator_queue_depth', len(watch_pending), queue='watch')
+    _metric_set('validator_scan_active', int(progress['active']))
+    _metric_set('validator_scan_throttled', int(progress['throttled']))
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/cancel-scan', methods=['POST'])
+def cancel_scan():
+    job_id = request.form.get('job_id', type=int)
+    if not cancel_scan_job(job_id):
+        return jsonify({'error': 'No matching scan job to cancel'}), 400
+    return jsonify({'status': 'cancelling', 'message': 'Scan cancellation requested'})
+
+def _encode_cursor(row, column='last_checked'):
+    return f"{row[column]}|{row['id']}"
+
+def _decode_cursor(cursor):
+    try:
+        last_checked, row_id = cursor.rsplit('|', 1)
+        return last_checked, int(row_id)
+    except (AttributeError, ValueError):
+        return None
+
+def _fetch_results_page(conn, media_type, status_filter, after=None, before=None, per_page=RESULTS_PER_PAGE):
+    # Keyset pagination on (last_checked, id) so deep pages cost the same as the first one
+    where = 'media_type = ?'
+    params = [media_type]
+    if status_filter == 'failed':
+        where += " AND status = 'failed'"
+    order = 'DESC'
+    if after:
+        where += ' AND (last_checked, id) < (?, ?)'
+        params += after
+    elif before:
+        where += ' AND (last_checked, id) > (?, ?)'
+        params += before
+        order = 'ASC'
+    rows = conn.execute(f'''
+        SELECT {RESULT_COLUMNS} FROM validation_results
+        WHERE {where}
+        ORDER BY last_checked {order}, id {order}
+        LIMIT ?
+    ''', params + [per_page + 1]).fetchall()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if before:
+        rows.reverse()
+    next_cursor = _encode_cursor(rows[-1]) if rows and (has_more or before) else None
+    prev_cursor = _encode_cursor(rows[0]) if rows and (after or (before and has_more)) else None
+    return rows, next_cursor, prev_cursor
 
 @app.route('/results')
 def results():
-    media_type = request.args.get('media', 'movie')
+    media_type = request.args.get('media', next(iter(libraries), ''))
     status_filter = request.args.get('status', 'all')
     page = request.args.get('page', 1, type=int)
-    per_page = 200
-    offset = (page - 1) * per_page
+    after = _decode_cursor(request.args.get('after'))
+    before = _decode_cursor(request.args.get('before'))
     conn = get_db_connection()
-    base_query = 'SELECT * FROM validation_results WHERE media_type = ?'
-    count_query = 'SELECT COUNT(*) FROM validation_results WHERE media_type = ?'
-    if status_filter == 'failed':
-        base_query += ' AND status = "failed"'
-        count_query += ' AND status = "failed"'
-    total = conn.execute(count_query, (media_type,)).fetchone()[0]
-    total_pages = (total + per_page - 1) // per_page
-    results = conn.execute(
-        f'{base_query} ORDER BY last_checked DESC LIMIT ? OFFSET ?',
-        (media_type, per_page, offset)
-    ).fetchall()
-    failed_count = conn.execute(
-        'SELECT COUNT(*) FROM validation_results WHERE status = "failed"'
-    ).fetchone()[0]
+    # Counts come from the trigger-maintained counters so a page never scans the library
+    library_stats = {row['media_type']: row for row in conn.execute('SELECT * FROM library_stats')}
+    media_stats = library_stats.get(media_type)
+    total = media_stats['failed' if status_filter == 'failed' else 'total'] if media_stats else 0
+    total_pages = (total + RESULTS_PER_PAGE - 1) // RESULTS_PER_PAGE
+    results, next_cursor, prev_cursor = _fetch_results_page(conn, media_type, status_filter, after, before)
+    failed_count = sum(row['failed'] for row in library_stats.values())
     conn.close()
     return render_template(
         'results.html',
+        libraries=libraries.values(),
         results=results,
         current_filter=status_filter,
         media_type=media_type,
         page=page,
         total_pages=total_pages,
         total_results=total,
-        failed_count=failed_count
+        failed_count=failed_count,
+        next_cursor=next_cursor,
+        prev_cursor=prev_cursor
     )
 
+@app.route('/api/results')
+def api_results():
+    media_type = request.args.get('media', next(iter(libraries), ''))
+    status_filter = request.args.get('status', 'all')
+    per_page = min(max(request.args.get('limit', RESULTS_PER_PAGE, type=int), 1), 1000)
+    conn = get_db_connection()
+    rows, next_cursor, prev_cursor = _fetch_results_page(
+        conn, media_type, status_filter,
+        _decode_cursor(request.args.get('after')), _decode_cursor(request.args.get('before')), per_page
+    )
+    conn.close()
+    return jsonify({
+        'results': [dict(row) for row in rows],
+        'next_cursor': next_cursor,
+        'prev_cursor': prev_cursor
+    })
+
 @app.route('/')
 def dashboard():
     conn = get_db_connection()
+    library_stats = {row['media_type']: row for row in conn.execute('SELECT * FROM library_stats')}
+    failures = {
+        (row['media_type'], row['checkpoint']): row['failed']
+        for row in conn.execute('SELECT * FROM checkpoint_failures')
+    }
+    conn.close()
     stats = {}
-    for media_type in MEDIA_PATHS:
-        media_stats = conn.execute('''
-            SELECT 
-                COUNT(*) AS total_files,
-                SUM(CASE WHEN status = 'passed' THEN 1 ELSE 0 END) AS passed_files,
-                SUM(CASE WHEN status = 'failed' THEN 1 ELSE 0 END) AS failed_files,
-                SUM(CASE WHEN check_1m = 0 THEN 1 ELSE 0 END) AS failed_1m,
-                SUM(CASE WHEN check_5m = 0 THEN 1 ELSE 0 END) AS failed_5m,
-                SUM(CASE WHEN check_10m = 0 THEN 1 ELSE 0 END) AS failed_10m,
-                SUM(CASE WHEN check_30m = 0 THEN 1 ELSE 0 END) AS failed_30m
-            FROM validation_results
-            WHERE media_type = ?
-        ''', (media_type,)).fetchone()
-        stats[media_type] = {
-            'total': media_stats['total_files'] or 0,
-            'passed': media_stats['passed_files'] or 0,
-            'failed': media_stats['failed_files'] or 0,
-            'checkpoints': {
-                '1m': media_stats['failed_1m'] or 0,
-                '5m': media_stats['failed_5m'] or 0,
-                '10m': media_stats['failed_10m'] or 0,
-                '30m': media_stats['failed_30m'] or 0
-            }
+    for name, library in libraries.items():
+        media_stats = library_stats.get(name)
+        stats[name] = {
+            'label': library['label'],
+            'enabled': library['enabled'],
+            'total': media_stats['total'] if media_stats else 0,
+            'passed': media_stats['passed'] if media_stats else 0,
+            'failed': media_stats['failed'] if media_stats else 0,
+            'checkpoints': [
+                (_checkpoint_label(seconds), failures.get((name, seconds), 0)) for seconds in library['checkpoints']
+            ]
         }
-    conn.close()
     return render_template('dashboard.html', stats=stats)
 
 @app.route('/start-repair', methods=['POST'])
 def start_repair():
     global repair_progress
-    if repair_progress['active']:
-        return jsonify({'error': 'Repair already in progress'}), 400
+    # Checked and claimed under one lock so two quick POSTs cannot both start a pool
+    with repair_lock:
+        if repair_progress['active']:
+            return jsonify({'error': 'Repair already in progress'}), 400
+        repair_progress = {
+            'active': True,
+            'current_file': '',
+            'completed': 0,
+            'succeeded': 0,
+            'failed': 0,
+            'total': 0,
+            'queued_remux': 0,
+            'queued_reencode': 0,
+            'workers': {},
+            'status': 'starting'
+        }
     app.logger.info("Starting repair thread")
-    repair_progress = {
-        'active': False,
-        'current_file': '',
-        'completed': 0,
-        'total': 0,
-        'status': 'starting'
-    }
+    _publish_repair()
     repair_thread = threading.Thread(
         target=repair_all_failed_files,
         name="VideoRepair",
@@ -526,7 +2888,7 @@ def start_repair():
 
 @app.route('/repair-progress')
 def get_repair_progress():
-    return jsonify(repair_progress)
+    return jsonify(_repair_snapshot())
 
 @app.route('/settings', methods=['GET', 'POST'])
 def settings():
@@ -534,27 +2896,189 @@ def settings():
     settings = conn.execute('SELECT * FROM app_settings').fetchone()
     if request.method == 'POST':
         schedule_type = request.form['schedule_type']
-        day_of_week = request.form.get('day_of_week')
+        # The weekly and monthly sections each submit a day_of_week field
+        days = request.form.getlist('day_of_week')
+        day_of_week = days[-1] if schedule_type == 'monthly' and days else request.form.get('day_of_week')
         occurrence = request.form.get('occurrence')
         run_time = request.form['run_time']
+        # Restart the schedule from now so a changed schedule does not fire immediately
         conn.execute('''
             UPDATE app_settings
-            SET schedule_type = ?, day_of_week = ?, occurrence = ?, run_time = ?
-        ''', (schedule_type, day_of_week, occurrence, run_time))
+            SET schedule_type = ?, day_of_week = ?, occurrence = ?, run_time = ?, last_scheduled_run = ?
+        ''', (schedule_type, day_of_week, occurrence, run_time, datetime.now()))
         conn.commit()
+        conn.close()
         return redirect(url_for('settings'))
+    library_rows = conn.execute('SELECT * FROM libraries ORDER BY id').fetchall()
     conn.close()
-    return render_template('settings.html', settings=settings)
+    next_run = None
+    if settings['last_scheduled_run'] is not None:
+        next_run = next_scheduled_run(settings, datetime.fromisoformat(str(settings['last_scheduled_run'])))
+    return render_template(
+        'settings.html', settings=settings, next_run=next_run, library_rows=library_rows
+    )
+
+def _library_form(form):
+    # Row values for a library submitted on the Settings page; raises ValueError with the message to show
+    name = form.get('name', '').strip().lower()
+    if not LIBRARY_NAME_PATTERN.match(name):
+        raise ValueError('Library names may only contain lowercase letters, digits, "-" and "_"')
+    paths = [path.strip() for path in form.get('paths', '').splitlines() if path.strip()]
+    if not paths or not all(os.path.isabs(path) for path in paths):
+        raise ValueError('Give at least one absolute path, one per line')
+    extensions = sorted({
+        '.' + ext.strip().lower().lstrip('.') for ext in form.get('extensions', '').split(',') if ext.strip()
+    })
+    if not extensions:
+        raise ValueError('Give at least one file extension')
+    try:
+        checkpoints = _parse_checkpoints(form.get('checkpoints', ''))
+    except ValueError:
+        raise ValueError('Checkpoints must be whole seconds separated by commas')
+    if not checkpoints or checkpoints[0] < 0:
+        raise ValueError('Give at least one checkpoint')
+    workers = form.get('workers', type=int)
+    checkpoint_timeout = form.get('checkpoint_timeout', type=int)
+    if (workers is not None and workers < 1) or (checkpoint_timeout is not None and checkpoint_timeout < 1):
+        raise ValueError('Workers and timeout must be positive, or empty for the defaults')
+    return (
+        name, form.get('label', '').strip() or name.capitalize(), '\n'.join(paths), ','.join(extensions),
+        ','.join(str(seconds) for seconds in checkpoints), workers, checkpoint_timeout,
+        1 if form.get('enabled') else 0
+    )
+
+@app.route('/settings/libraries', methods=['POST'])
+def save_library():
+    action = request.form.get('action', 'save')
+    conn = get_db_connection()
+    try:
+        if action == 'delete':
+            name = request.form.get('name')
+            if _scan_snapshot()['active']:
+                flash('Libraries cannot be deleted while a scan is running', 'error')
+                return redirect(url_for('settings'))
+            with conn:
+                # The library's results go with it; the triggers clear their checkpoints and counters
+                conn.execute('DELETE FROM validation_results WHERE media_type = ?', (name,))
+                conn.execute('DELETE FROM library_stats WHERE media_type = ?', (name,))
+                conn.execute('DELETE FROM checkpoint_failures WHERE media_type = ?', (name,))
+                conn.execute('DELETE FROM libraries WHERE name = ?', (name,))
+            app.logger.info(f"Deleted library {name}")
+        else:
+            try:
+                values = _library_form(request.form)
+                if action == 'add' and values[0] in libraries:
+                    raise ValueError(f'A library named {values[0]} already exists')
+            except ValueError as e:
+                flash(str(e), 'error')
+                return redirect(url_for('settings'))
+            with conn:
+                conn.execute('''
+                    INSERT INTO libraries
+                    (name, label, paths, extensions, checkpoints, workers, checkpoint_timeout, enabled)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (name) DO UPDATE SET
+                        label = excluded.label, paths = excluded.paths, extensions = excluded.extensions,
+                        checkpoints = excluded.checkpoints, workers = excluded.workers,
+                        checkpoint_timeout = excluded.checkpoint_timeout, enabled = excluded.enabled
+                ''', values)
+            app.logger.info(f"Saved library {values[0]}")
+    finally:
+        conn.close()
+    load_libraries()
+    return redirect(url_for('settings'))
+
+def _fetch_history_page(conn, after=None, before=None, per_page=HISTORY_PER_PAGE):
+    # Keyset pagination on (scan_time, id), newest first, like the results pages
+    where = '1'
+    params = []
+    order = 'DESC'
+    if after:
+        where = '(scan_time, id) < (?, ?)'
+        params += after
+    elif before:
+        where = '(scan_time, id) > (?, ?)'
+        params += before
+        order = 'ASC'
+    rows = conn.execute(f'''
+        SELECT * FROM scan_history
+        WHERE {where}
+        ORDER BY scan_time {order}, id {order}
+        LIMIT ?
+    ''', params + [per_page + 1]).fetchall()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if before:
+        rows.reverse()
+    next_cursor = _encode_cursor(rows[-1], 'scan_time') if rows and (has_more or before) else None
+    prev_cursor = _encode_cursor(rows[0], 'scan_time') if rows and (after or (before and has_more)) else None
+    return rows, next_cursor, prev_cursor
+
+def _repeat_failures(conn, days, min_failures, limit):
+    # Left to itself the planner walks the whole path index to serve the GROUP BY, so the
+    # covering event index is forced: only the window's failures are read, then grouped
+    return conn.execute('''
+        SELECT filepath, media_type, COUNT(*) AS failures,
+               MIN(event_time) AS first_failed, MAX(event_time) AS last_failed
+        FROM failure_timeline INDEXED BY idx_failure_timeline_event
+        WHERE event = 'failed' AND event_time >= ?
+        GROUP BY filepath
+        HAVING COUNT(*) >= ?
+        ORDER BY failures DESC, last_failed DESC
+        LIMIT ?
+    ''', (datetime.now() - timedelta(days=days), min_failures, limit)).fetchall()
 
 @app.route('/scan-history')
 def scan_history():
+    page = request.args.get('page', 1, type=int)
     conn = get_db_connection()
-    history = conn.execute('''
-        SELECT * FROM scan_history 
-        ORDER BY scan_time DESC
-    ''').fetchall()
+    history, next_cursor, prev_cursor = _fetch_history_page(
+        conn, _decode_cursor(request.args.get('after')), _decode_cursor(request.args.get('before'))
+    )
+    repeat_failures = _repeat_failures(conn, 90, 2, 20)
+    conn.close()
+    return render_template(
+        'scan_history.html',
+        history=history,
+        page=page,
+        next_cursor=next_cursor,
+        prev_cursor=prev_cursor,
+        repeat_failures=repeat_failures
+    )
+
+@app.route('/api/scan-history')
+def api_scan_history():
+    per_page = min(max(request.args.get('limit', HISTORY_PER_PAGE, type=int), 1), 1000)
+    conn = get_db_connection()
+    rows, next_cursor, prev_cursor = _fetch_history_page(
+        conn, _decode_cursor(request.args.get('after')), _decode_cursor(request.args.get('before')), per_page
+    )
+    conn.close()
+    return jsonify({
+        'history': [dict(row) for row in rows],
+        'next_cursor': next_cursor,
+        'prev_cursor': prev_cursor
+    })
+
+@app.route('/api/failure-timeline')
+def api_failure_timeline():
+    filepath = request.args.get('path')
+    conn = get_db_connection()
+    if filepath:
+        rows = conn.execute('''
+            SELECT event_time, event, diagnosis, scan_id FROM failure_timeline
+            WHERE filepath = ?
+            ORDER BY event_time
+        ''', (filepath,)).fetchall()
+        conn.close()
+        return jsonify({'filepath': filepath, 'events': [dict(row) for row in rows]})
+    # Without a path: the files that failed at least min_failures times in the last days
+    rows = _repeat_failures(
+        conn, request.args.get('days', 90, type=int), request.args.get('min_failures', 2, type=int),
+        min(max(request.args.get('limit', 100, type=int), 1), 1000)
+    )
     conn.close()
-    return render_template('scan_history.html', history=history)
+    return jsonify({'files': [dict(row) for row in rows]})
 
 # Add to app.py temporarily
 @app.route('/debug-templates')
@@ -567,4 +3091,5 @@ def debug_templates():
 
 
 if __name__ == '__main__':
+    start_background_services()
     app.run(host='0.0.0.0', port=5000)
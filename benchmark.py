@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# Benchmark for the scan and repair paths. Generates synthetic media with ffmpeg, runs a full
+# scan, an incremental scan and a repair pass against a throwaway database, and reports
+# throughput and per-phase latency percentiles.
+#
+#   python benchmark.py --files 12 --duration 660 --json results.json
+#   python benchmark.py --baseline results.json   # exits 1 on a regression
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+LIBRARIES = {'movie': '.mkv', 'tv': '.mp4'}
+# Latency changes smaller than this are scheduling noise, whatever the relative change
+MIN_REGRESSION_SECONDS = 0.005
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the video validator scan and repair paths')
+    parser.add_argument('--files', type=int, default=8, help='files per library (default: 8)')
+    parser.add_argument('--duration', type=int, default=660,
+                        help='seconds of media per file; 660 reaches every TV and the 10m movie checkpoint')
+    parser.add_argument('--workers', type=int, help='SCAN_WORKERS for the run (default: app default)')
+    parser.add_argument('--workdir', help='keep media and database here instead of a temporary directory')
+    parser.add_argument('--skip-repair', action='store_true', help='do not benchmark the repair pass')
+    parser.add_argument('--spawn-runs', type=int, default=20, help='ffmpeg launches used to measure spawn overhead')
+    parser.add_argument('--seed', type=int, default=1, help='seed for the corrupted variants')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='compare against a previous --json file')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative slowdown against the baseline (default: 0.25)')
+    return parser.parse_args()
+
+class Timings:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.samples.setdefault(name, []).append(seconds)
+
+    def wrap(self, module, attr, name=None):
+        # Replacing the module global is enough: app.py looks its helpers up at call time
+        func = getattr(module, attr)
+        name = name or attr
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(name, time.perf_counter() - start)
+        setattr(module, attr, timed)
+
+    def summary(self):
+        with self.lock:
+            return {name: summarize(values) for name, values in self.samples.items()}
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+def summarize(values):
+    return {
+        'count': len(values),
+        'total': sum(values),
+        'p50': percentile(values, 0.5),
+        'p90': percentile(values, 0.9),
+        'p99': percentile(values, 0.99),
+        'max': max(values)
+    }
+
+def generate_source(path, duration):
+    subprocess.run([
+        'ffmpeg', '-y', '-v', 'error',
+        '-f', 'lavfi', '-i', f'testsrc=size=320x240:rate=10:duration={duration}',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '50',
+        '-c:a', 'aac', '-b:a', '64k', '-shortest', path
+    ], check=True)
+
+def truncate(path):
+    # Cut the file in half: the later checkpoints run past the end of the data
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) // 2)
+
+def corrupt(path, rng, duration):
+    # Damage the two seconds after every checkpoint position (the bitrate is roughly constant)
+    # so the checkpoint decode hits broken packets while the container header stays readable
+    size = os.path.getsize(path)
+    bytes_per_second = size // duration
+    with open(path, 'r+b') as f:
+        for seconds in (60, 300, 600, 1800):
+            if seconds + 2 >= duration:
+                continue
+            start = size * seconds // duration
+            for offset in range(start, start + 2 * bytes_per_second, 2048):
+                f.seek(offset + rng.randrange(1024))
+                f.write(rng.randbytes(1024))
+
+def generate_media(media_root, files, duration, seed):
+    rng = random.Random(seed)
+    expected = {}
+    for m_type, extension in LIBRARIES.items():
+        library = os.path.join(media_root, m_type)
+        os.makedirs(library, exist_ok=True)
+        source = os.path.join(media_root, f'source{extension}')
+        generate_source(source, duration)
+        for index in range(files):
+            # Every third file is truncated and every third (offset by one) corrupted
+            variant = ('truncated', 'corrupted', 'valid')[index % 3]
+            path = os.path.join(library, f'{m_type}_{index:03d}_{variant}{extension}')
+            shutil.copyfile(source, path)
+            if variant == 'truncated':
+                truncate(path)
+            elif variant == 'corrupted':
+                corrupt(path, rng, duration)
+            expected[path] = variant
+        os.remove(source)
+    return expected
+
+def measure_spawn(runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(['ffmpeg', '-version'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+def run_scan(app_module, full_rescan):
+    app_module.scan_progress.update(total=0, completed=0)
+    start = time.perf_counter()
+    error = None
+    try:
+        scanned = app_module._run_scan(full_rescan=full_rescan)
+    except Exception as e:
+        # Keep the timings: the files were validated even if the bookkeeping failed
+        scanned = app_module.scan_progress.get('completed', 0)
+        error = str(e)
+    elapsed = time.perf_counter() - start
+    result = {
+        'seconds': elapsed,
+        'files': scanned,
+        'files_per_sec': scanned / elapsed if elapsed > 0 else 0.0
+    }
+    if error:
+        result['error'] = error
+    return result
+
+def run_repairs(app_module):
+    conn = app_module.get_db_connection()
+    try:
+        failed = [(row['filepath'], row['media_type']) for row in conn.execute(
+            "SELECT filepath, media_type FROM validation_results WHERE status = 'failed' ORDER BY filepath"
+        )]
+    finally:
+        conn.close()
+    outcomes = {}
+    start = time.perf_counter()
+    for filepath, media_type in failed:
+        status, message = app_module.repair_video_file(filepath)
+        if status == 'success':
+            app_module._revalidate_repaired(filepath, media_type)
+        outcomes[message] = outcomes.get(message, 0) + 1
+    elapsed = time.perf_counter() - start
+    return {
+        'seconds': elapsed,
+        'files': len(failed),
+        'files_per_sec': len(failed) / elapsed if elapsed > 0 else 0.0,
+        'outcomes': outcomes
+    }
+
+def detection(app_module, variants):
+    # How many files of each variant the full scan flagged as failed
+    conn = app_module.get_db_connection()
+    try:
+        statuses = {row['filepath']: row['status'] for row in conn.execute(
+            'SELECT filepath, status FROM validation_results'
+        )}
+    finally:
+        conn.close()
+    counts = {}
+    for path, variant in variants.items():
+        flagged, total = counts.get(variant, (0, 0))
+        counts[variant] = (flagged + (statuses.get(path) == 'failed'), total + 1)
+    return {variant: {'failed': flagged, 'files': total} for variant, (flagged, total) in counts.items()}
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for phase in ('full_scan', 'incremental_scan', 'repair'):
+        current, previous = results.get(phase), baseline.get(phase)
+        if not current or not previous or not previous.get('files_per_sec'):
+            continue
+        if current['files_per_sec'] < previous['files_per_sec'] * (1 - tolerance):
+            regressions.append(
+                f"{phase}: {current['files_per_sec']:.2f} files/s, baseline {previous['files_per_sec']:.2f}"
+            )
+    for name, current in results.get('timings', {}).items():
+        previous = baseline.get('timings', {}).get(name)
+        if not previous or current['p50'] - previous['p50'] < MIN_REGRESSION_SECONDS:
+            continue
+        if current['p50'] > previous['p50'] * (1 + tolerance):
+            regressions.append(
+                f"{name}: p50 {current['p50'] * 1000:.1f} ms, baseline {previous['p50'] * 1000:.1f} ms"
+            )
+    return regressions
+
+def print_report(results):
+    print(f"\nMedia: {results['files']} files ({results['duration']}s each), "
+          f"{results['scan_workers']} scan workers")
+    for phase in ('full_scan', 'incremental_scan', 'repair'):
+        data = results.get(phase)
+        if not data:
+            continue
+        line = f"{phase:<18} {data['files']:>5} files  {data['seconds']:>8.2f} s  {data['files_per_sec']:>8.2f} files/s"
+        if data.get('error'):
+            line += f"  (error: {data['error']})"
+        print(line)
+        for message, count in data.get('outcomes', {}).items():
+            print(f"{'':<18} {count:>5} x {message}")
+    print('\nFlagged as failed: ' + ', '.join(
+        f"{variant} {data['failed']}/{data['files']}" for variant, data in sorted(results['detection'].items())
+    ))
+    print(f"\n{'phase':<26}{'count':>7}{'total s':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    timings = dict(results['timings'], ffmpeg_spawn=results['ffmpeg_spawn'])
+    for name, data in sorted(timings.items()):
+        print(f"{name:<26}{data['count']:>7}{data['total']:>10.2f}"
+              f"{data['p50'] * 1000:>10.1f}{data['p90'] * 1000:>10.1f}"
+              f"{data['p99'] * 1000:>10.1f}{data['max'] * 1000:>10.1f}")
+    db_time = sum(results['timings'].get(name, {}).get('total', 0) for name in ('db_flush', 'db_load_rows'))
+    print(f"\nDB time: {db_time:.2f} s")
+
+def main():
+    args = parse_args()
+    workdir = args.workdir or tempfile.mkdtemp(prefix='video-validator-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    database_path = os.path.join(workdir, 'benchmark.db')
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(database_path + suffix):
+            os.remove(database_path + suffix)
+    # app.py reads its configuration and creates the database at import time
+    os.environ['DATABASE_PATH'] = database_path
+    if args.workers:
+        os.environ['SCAN_WORKERS'] = str(args.workers)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as app_module
+    logging.getLogger().setLevel(logging.WARNING)
+    app_module.app.logger.setLevel(logging.WARNING)
+
+    media_root = os.path.join(workdir, 'media')
+    shutil.rmtree(media_root, ignore_errors=True)
+    print(f"Generating {args.files} files per library in {media_root} ...")
+    start = time.perf_counter()
+    variants = generate_media(media_root, args.files, args.duration, args.seed)
+    print(f"Generated media in {time.perf_counter() - start:.1f} s")
+    # The fresh database is seeded with the default movie and tv libraries; point them at the media
+    conn = app_module.get_db_connection()
+    with conn:
+        conn.executemany('UPDATE libraries SET paths = ? WHERE name = ?', [
+            (os.path.join(media_root, m_type), m_type) for m_type in LIBRARIES
+        ])
+    conn.close()
+    app_module.load_libraries()
+
+    timings = Timings()
+    timings.wrap(app_module, 'validate_video')
+    timings.wrap(app_module, 'should_validate_file')
+    timings.wrap(app_module, '_snapshot_library', 'walk_library')
+    timings.wrap(app_module, '_load_library_rows', 'db_load_rows')
+    timings.wrap(app_module, '_flush_results', 'db_flush')
+    timings.wrap(app_module, '_run_ffmpeg', 'ffmpeg_run')
+    timings.wrap(app_module, '_content_fingerprint', 'fingerprint')
+    timings.wrap(app_module, '_run_repair_strategies', 'repair_strategies')
+    timings.wrap(app_module, '_create_backup', 'repair_backup')
+
+    results = {
+        'files': args.files * len(LIBRARIES),
+        'duration': args.duration,
+        'scan_workers': app_module.SCAN_WORKERS,
+        'ffmpeg_spawn': measure_spawn(args.spawn_runs)
+    }
+    results['full_scan'] = run_scan(app_module, full_rescan=True)
+    results['detection'] = detection(app_module, variants)
+    results['incremental_scan'] = run_scan(app_module, full_rescan=False)
+    if not args.skip_repair:
+        results['repair'] = run_repairs(app_module)
+    results['timings'] = timings.summary()
+    print_report(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print('\nRegressions against baseline:')
+            for regression in regressions:
+                print(f'  {regression}')
+            sys.exit(1)
+        print('\nNo regressions against baseline')
+
+if __name__ == '__main__':
+    main()